@@ -3,26 +3,40 @@ FastAPI wrapper for MCP Server deployment to Azure Web App
 """
 
 import asyncio
+import hashlib
+import hmac
 import json
 import logging
 import os
-from typing import Dict, Any
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, Optional
 from fastapi import FastAPI, Request, Response, HTTPException, WebSocket
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from starlette.requests import HTTPConnection
 
+from compression import CompressionMiddleware
 from main import MCPServer, MCPRequest, MCPResponse
+from scheduler import RateLimiter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Restore persisted uploads in each worker and save them on shutdown"""
+    mcp_server.restore_uploads()
+    yield
+    await mcp_server.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="MCP Server",
     description="Model Context Protocol Server",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -34,9 +48,148 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (base64 PDFs, tool schemas) per Accept-Encoding
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("MCP_COMPRESS_MIN_SIZE", 1024)),
+    offload_size=int(os.environ.get("MCP_COMPRESS_OFFLOAD_SIZE", 65536)),
+)
+
 # Global MCP server instance
 mcp_server = MCPServer()
 
+SESSION_HEADER = "Mcp-Session-Id"
+
+# Session IDs are signed so only IDs issued on initialize are honoured. With
+# --preload the random key is created once in the master and shared by all
+# workers; set MCP_SESSION_SECRET when workers are not forked from one parent.
+SESSION_SECRET = os.environ.get("MCP_SESSION_SECRET", "").encode() or os.urandom(32)
+
+def _sign_session(token: str) -> str:
+    return hmac.new(SESSION_SECRET, token.encode(), hashlib.sha256).hexdigest()[:32]
+
+def issue_session_id() -> str:
+    """Create a new signed session ID"""
+    token = uuid.uuid4().hex
+    return f"{token}.{_sign_session(token)}"
+
+def verify_session_id(session_id: str) -> bool:
+    """Whether a session ID was issued by this server"""
+    token, _, signature = session_id.partition(".")
+    return bool(token) and hmac.compare_digest(signature, _sign_session(token))
+
+# Proxies in front of the app that append the peer they saw to X-Forwarded-For
+# (1 behind the App Service front end). Entries left of those are written by
+# the client and never trusted.
+TRUSTED_PROXY_HOPS = int(os.environ.get("MCP_TRUSTED_PROXY_HOPS", 0))
+
+# New sessions (initialize without a session, WebSocket connections) per
+# client address, so clients cannot mint sessions to dodge fair queuing
+session_limiter = RateLimiter.for_sessions()
+
+def _strip_port(address: str) -> str:
+    if address.startswith("["):
+        return address[1:].partition("]")[0]
+    if address.count(":") == 1:
+        return address.partition(":")[0]
+    return address
+
+def client_address(connection: HTTPConnection) -> str:
+    """Address of the client, as seen by the outermost trusted proxy"""
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = [
+            entry.strip() for entry in connection.headers.get("x-forwarded-for", "").split(",")
+            if entry.strip()
+        ]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return _strip_port(forwarded[-TRUSTED_PROXY_HOPS])
+    return connection.client.host if connection.client else "unknown"
+
+def too_many_sessions_response(request_id: Any = None) -> JSONResponse:
+    """429 for a client creating sessions faster than MCP_NEW_SESSION_RATE"""
+    return JSONResponse(
+        content={
+            "jsonrpc": "2.0",
+            "error": {"code": -32002, "message": "Too many new sessions, reuse your Mcp-Session-Id"},
+            "id": request_id
+        },
+        status_code=429
+    )
+
+def get_session_id(request: Request) -> Optional[str]:
+    """Resolve the scheduling session of an HTTP request
+    
+    Returns None when the request carries a session ID this server did not
+    issue, so clients cannot mint fresh sessions to dodge fair queuing.
+    """
+    session_id = request.headers.get(SESSION_HEADER)
+    if session_id:
+        return session_id if verify_session_id(session_id) else None
+    # Clients without a session header are grouped by client address
+    return f"http:{client_address(request)}"
+
+def unknown_session_response(request_id: Any = None) -> JSONResponse:
+    """404 telling the client to initialize a new session"""
+    return JSONResponse(
+        content={
+            "jsonrpc": "2.0",
+            "error": {"code": -32001, "message": "Session not found, send initialize to start a new one"},
+            "id": request_id
+        },
+        status_code=404
+    )
+
+def format_response(response: MCPResponse) -> Dict[str, Any]:
+    """Build the JSON-RPC message for an MCP response"""
+    response_data = {
+        "jsonrpc": "2.0",
+        "id": response.id
+    }
+    
+    if response.result is not None:
+        response_data["result"] = response.result
+    if response.error is not None:
+        response_data["error"] = response.error
+    
+    return response_data
+
+def wants_event_stream(request: Request) -> bool:
+    """Whether the client accepts a Streamable HTTP (SSE) response"""
+    return "text/event-stream" in request.headers.get("accept", "")
+
+def sse_event(message: Dict[str, Any]) -> str:
+    """Encode a JSON-RPC message as a server-sent event"""
+    return f"event: message\ndata: {json.dumps(message)}\n\n"
+
+async def stream_mcp_request(mcp_request: MCPRequest) -> AsyncIterator[str]:
+    """Run a request, streaming its notifications and then its response as SSE"""
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def run():
+        try:
+            response = await mcp_server.handle_request(mcp_request, queue.put)
+            await queue.put(format_response(response))
+        except Exception as e:
+            logger.error(f"Error handling streamed MCP request: {e}")
+            await queue.put({
+                "jsonrpc": "2.0",
+                "error": {"code": -32603, "message": f"Internal error: {str(e)}"},
+                "id": mcp_request.id
+            })
+        finally:
+            await queue.put(None)
+    
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            yield sse_event(message)
+    finally:
+        # Client went away before the tool finished
+        task.cancel()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -73,25 +226,36 @@ async def handle_mcp_request(request: Request):
     try:
         body = await request.json()
         
+        headers = {}
+        if body.get("method") == "initialize" and not request.headers.get(SESSION_HEADER):
+            # Assign a session on initialize, clients echo it back on later requests
+            if not session_limiter.allow(client_address(request)):
+                return too_many_sessions_response(body.get("id"))
+            session_id = issue_session_id()
+            headers[SESSION_HEADER] = session_id
+        else:
+            session_id = get_session_id(request)
+            if session_id is None:
+                return unknown_session_response(body.get("id"))
+        
         mcp_request = MCPRequest(
             method=body.get("method"),
             params=body.get("params", {}),
-            id=body.get("id")
+            id=body.get("id"),
+            session_id=session_id
         )
         
-        response = await mcp_server.handle_request(mcp_request)
-        
-        response_data = {
-            "jsonrpc": "2.0",
-            "id": response.id
-        }
+        # Tool calls are streamed when the client accepts SSE (Streamable HTTP)
+        if mcp_request.method == "tools/call" and wants_event_stream(request):
+            return StreamingResponse(
+                stream_mcp_request(mcp_request),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", **headers}
+            )
         
-        if response.result is not None:
-            response_data["result"] = response.result
-        if response.error is not None:
-            response_data["error"] = response.error
+        response = await mcp_server.handle_request(mcp_request)
         
-        return JSONResponse(content=response_data)
+        return JSONResponse(content=format_response(response), headers=headers)
         
     except Exception as e:
         logger.error(f"Error handling MCP request: {e}")
@@ -107,8 +271,15 @@ async def handle_mcp_request(request: Request):
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for MCP communication"""
+    if not session_limiter.allow(client_address(websocket)):
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
     await websocket.accept()
     
+    # Each WebSocket connection is its own scheduling session
+    session_id = f"ws:{uuid.uuid4().hex}"
+    
     try:
         while True:
             # Receive message
@@ -120,22 +291,16 @@ async def websocket_endpoint(websocket: WebSocket):
                 mcp_request = MCPRequest(
                     method=request_data.get("method"),
                     params=request_data.get("params", {}),
-                    id=request_data.get("id")
+                    id=request_data.get("id"),
+                    session_id=session_id
                 )
                 
-                response = await mcp_server.handle_request(mcp_request)
+                async def notify(notification: Dict[str, Any]):
+                    await websocket.send_text(json.dumps(notification))
                 
-                response_data = {
-                    "jsonrpc": "2.0",
-                    "id": response.id
-                }
-                
-                if response.result is not None:
-                    response_data["result"] = response.result
-                if response.error is not None:
-                    response_data["error"] = response.error
+                response = await mcp_server.handle_request(mcp_request, notify)
                 
-                await websocket.send_text(json.dumps(response_data))
+                await websocket.send_text(json.dumps(format_response(response)))
                 
             except json.JSONDecodeError:
                 error_response = {
@@ -153,6 +318,10 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.post("/tools/call")
 async def call_tool(request: Request):
     """Call a specific tool"""
+    session_id = get_session_id(request)
+    if session_id is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
     try:
         body = await request.json()
         tool_name = body.get("name")
@@ -163,7 +332,8 @@ async def call_tool(request: Request):
         
         mcp_request = MCPRequest(
             method="tools/call",
-            params={"name": tool_name, "arguments": arguments}
+            params={"name": tool_name, "arguments": arguments},
+            session_id=session_id
         )
         
         response = await mcp_server.handle_request(mcp_request)
@@ -179,5 +349,9 @@ async def call_tool(request: Request):
 
 # For Azure Web App
 if __name__ == "__main__":
+    # Only needed when run directly; gunicorn workers import uvicorn themselves
+    import uvicorn
+    
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # permessage-deflate compresses WebSocket frames when the client offers it
+    uvicorn.run(app, host="0.0.0.0", port=port, ws_per_message_deflate=True)
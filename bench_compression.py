@@ -0,0 +1,86 @@
+"""
+Benchmark response compression for typical MCP payloads
+
+Reports bytes on the wire and CPU time per encoding at several payload
+sizes, for a resources/read response carrying a base64 PDF and for a
+tools/list schema document.
+
+Usage: python bench_compression.py
+"""
+
+import base64
+import json
+import os
+import time
+
+from compression import available_encoders
+
+SIZES = [1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024]
+ROUNDS = 5
+
+
+def pdf_payload(size: int) -> bytes:
+    """A resources/read response with roughly ``size`` bytes of base64 PDF"""
+    # Mix of compressible page text and incompressible (image-like) streams
+    page = b"BT /F1 12 Tf 72 712 Td (The quick brown fox jumps over the lazy dog) Tj ET\n"
+    raw_size = size * 3 // 4
+    text = (page * (raw_size // (2 * len(page)) + 1))[: raw_size // 2]
+    pdf = b"%PDF-1.7\n" + text + os.urandom(raw_size - len(text))
+    message = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {
+            "contents": [{
+                "uri": "uploaded://pdfs/uploaded_1",
+                "mimeType": "application/pdf",
+                "blob": base64.b64encode(pdf).decode("utf-8")
+            }]
+        }
+    }
+    return json.dumps(message).encode("utf-8")
+
+
+def schema_payload(size: int) -> bytes:
+    """A tools/list response of roughly ``size`` bytes"""
+    def tool(index):
+        return {
+            "name": f"tool_{index}",
+            "description": f"Generated tool number {index} used for benchmarking",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    f"param_{i}": {"type": "string", "description": f"Parameter {i} of tool {index}"}
+                    for i in range(5)
+                },
+                "required": ["param_0"]
+            }
+        }
+
+    count = max(1, size // len(json.dumps(tool(0))))
+    tools = [tool(index) for index in range(count)]
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"tools": tools}}).encode("utf-8")
+
+
+def measure(encoder, data: bytes):
+    """Return (compressed size, mean CPU seconds) for one encoder"""
+    compressed = encoder(data)
+    started = time.process_time()
+    for _ in range(ROUNDS):
+        encoder(data)
+    return len(compressed), (time.process_time() - started) / ROUNDS
+
+
+def main():
+    encoders = available_encoders()
+    print(f"{'payload':<10}{'size':>12}{'encoding':>10}{'wire bytes':>14}{'ratio':>8}{'cpu ms':>10}")
+    for name, build in (("pdf", pdf_payload), ("schema", schema_payload)):
+        for size in SIZES:
+            data = build(size)
+            print(f"{name:<10}{len(data):>12}{'identity':>10}{len(data):>14}{1.0:>8.2f}{0.0:>10.2f}")
+            for encoding, encoder in encoders.items():
+                wire, cpu = measure(encoder, data)
+                print(f"{name:<10}{len(data):>12}{encoding:>10}{wire:>14}{len(data) / wire:>8.2f}{cpu * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark the document search index
+
+Builds an index of synthetic pages, then reports query latency, the size of
+the saved index and the time to map it back in.
+
+Usage: python bench_search.py [pages]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from search_index import SearchIndex
+
+PAGES_PER_DOCUMENT = 100
+WORDS_PER_PAGE = 200
+VOCABULARY = [f"term{i}" for i in range(20000)]
+# Zipf ranks: term5 is on nearly every page, term19999 on a few hundred
+QUERIES = ["term19999", "term3000 term19999", "term500 term3000", "term5 term3000",
+           "term5", "term1 term2 term3 term4", "absent"]
+ROUNDS = 20
+
+
+def build(pages: int) -> SearchIndex:
+    """Index ``pages`` pages of Zipf-like random text"""
+    rng = random.Random(42)
+    weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+    index = SearchIndex()
+    for document in range(pages // PAGES_PER_DOCUMENT):
+        index.add_document(f"uploaded_{document + 1}", f"doc{document + 1}.pdf", {
+            page: " ".join(rng.choices(VOCABULARY, weights, k=WORDS_PER_PAGE))
+            for page in range(1, PAGES_PER_DOCUMENT + 1)
+        })
+    return index
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    started = time.perf_counter()
+    index = build(pages)
+    print(f"indexed {len(index)} pages in {time.perf_counter() - started:.1f}s")
+
+    for query in QUERIES:
+        rarest = min((len(index.get_postings(t)[0]) for t in query.split() if index.get_postings(t)), default=0)
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            index.search(query)
+        elapsed = (time.perf_counter() - started) / ROUNDS * 1000
+        print(f"query {query!r:<28} rarest df {rarest:>7} {elapsed:8.2f} ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.bin")
+        started = time.perf_counter()
+        index.save(path)
+        print(f"saved {os.path.getsize(path) / 1e6:.1f} MB in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        loaded = SearchIndex.load(path)
+        print(f"mapped in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        loaded.search(QUERIES[1])
+        print(f"first query after load {(time.perf_counter() - started) * 1000:.2f} ms")
+        del loaded
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark server cold start against a regression budget
+
+Boots the production command from startup.sh (gunicorn --preload with
+gunicorn.conf.py and uvicorn workers) and measures, each in a fresh process:
+- import time of app.py (what every gunicorn worker pays without --preload)
+- time from process start to the first successful GET /health
+- time from process start to the first successful tools/call over /mcp
+- time for a killed worker to be forked again from the preloaded master
+  and serve /health
+
+Exits non-zero when a median exceeds its budget.
+
+Usage: python bench_startup.py [--runs N] [--workers N] [--budget-import S]
+                               [--budget-health S] [--budget-call S]
+                               [--budget-respawn S]
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import app; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_import() -> float:
+    """Seconds to import app.py in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(url: str, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=2) as response:
+        return response.status, json.loads(response.read())
+
+
+def start_gunicorn(port: int, workers: int) -> subprocess.Popen:
+    """Start the server the way startup.sh does"""
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app",
+         "--config", "gunicorn.conf.py",
+         "--bind", f"127.0.0.1:{port}",
+         "--workers", str(workers),
+         "--worker-class", "uvicorn.workers.UvicornWorker",
+         "--preload"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_healthy(process: subprocess.Popen, base: str, started: float, timeout: float) -> float:
+    """Poll /health until it answers, returning seconds since ``started``"""
+    while True:
+        if time.perf_counter() - started > timeout or process.poll() is not None:
+            raise RuntimeError("Server did not become healthy")
+        try:
+            status, _ = request(f"{base}/health")
+            if status == 200:
+                return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.01)
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def measure_boot(workers: int, timeout: float = 30.0):
+    """Seconds from spawn to the first healthy response and first tool call"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = start_gunicorn(port, workers)
+    try:
+        health = wait_healthy(process, base, started, timeout)
+        status, result = request(f"{base}/mcp", {
+            "jsonrpc": "2.0", "id": 1, "method": "tools/call",
+            "params": {"name": "echo", "arguments": {"message": "ready"}}
+        })
+        if status != 200 or "result" not in result:
+            raise RuntimeError(f"tools/call failed: {result}")
+        return health, time.perf_counter() - started
+    finally:
+        stop(process)
+
+
+def measure_respawn(timeout: float = 30.0) -> float:
+    """Seconds from killing the only worker until its replacement serves /health"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    process = start_gunicorn(port, 1)
+    try:
+        wait_healthy(process, base, time.perf_counter(), timeout)
+        worker = int(subprocess.run(
+            ["pgrep", "-P", str(process.pid)], capture_output=True, text=True, check=True
+        ).stdout.split()[0])
+        started = time.perf_counter()
+        os.kill(worker, signal.SIGKILL)
+        # Requests queue on the master's socket until the new worker accepts
+        return wait_healthy(process, base, started, timeout)
+    finally:
+        stop(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="as in startup.sh")
+    parser.add_argument("--budget-import", type=float, default=1.0, help="seconds")
+    parser.add_argument("--budget-health", type=float, default=3.0, help="seconds")
+    parser.add_argument("--budget-call", type=float, default=3.0, help="seconds")
+    parser.add_argument("--budget-respawn", type=float, default=1.0, help="seconds")
+    args = parser.parse_args()
+
+    imports, healths, calls, respawns = [], [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        health, call = measure_boot(args.workers)
+        healths.append(health)
+        calls.append(call)
+        respawns.append(measure_respawn())
+
+    failed = False
+    for name, samples, budget in (
+        ("import app", imports, args.budget_import),
+        ("first /health", healths, args.budget_health),
+        ("first tools/call", calls, args.budget_call),
+        ("worker respawn", respawns, args.budget_respawn),
+    ):
+        median = statistics.median(samples)
+        ok = median <= budget
+        failed = failed or not ok
+        print(f"{name:<18} median {median * 1000:8.1f} ms  max {max(samples) * 1000:8.1f} ms  "
+              f"budget {budget * 1000:8.1f} ms  {'ok' if ok else 'OVER BUDGET'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Response compression for large HTTP payloads
+
+CompressionMiddleware compresses complete HTTP responses above a size
+threshold with the best encoding the client accepts: zstd or brotli when
+their optional packages are installed, gzip otherwise. Large bodies are
+compressed in a worker thread so the event loop keeps serving requests.
+Streamed responses (such as SSE) are passed through untouched.
+"""
+
+import asyncio
+import gzip
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth the compression overhead
+DEFAULT_MINIMUM_SIZE = 1024
+# Bodies at least this large are compressed off the event loop
+DEFAULT_OFFLOAD_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6)
+
+
+def _zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=4)
+
+
+def available_encoders() -> Dict[str, Callable[[bytes], bytes]]:
+    """Encoders usable in this environment, in server preference order"""
+    encoders = {}
+    if zstandard is not None:
+        encoders["zstd"] = _zstd
+    if brotli is not None:
+        encoders["br"] = _brotli
+    encoders["gzip"] = _gzip
+    return encoders
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into a {coding: qvalue} mapping"""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def select_encoding(header: str, encoders: Dict[str, Callable[[bytes], bytes]]) -> Optional[str]:
+    """Pick the preferred encoding accepted by the client, if any"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    best_quality = 0.0
+    for coding in encoders:
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large HTTP responses"""
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        offload_size: int = DEFAULT_OFFLOAD_SIZE,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.encoders = available_encoders()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        encoding = select_encoding(
+            headers.get(b"accept-encoding", b"").decode("latin-1"), self.encoders
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    async def compress(self, encoding: str, body: bytes) -> bytes:
+        """Compress a body, in a worker thread when it is large"""
+        encoder = self.encoders[encoding]
+        if len(body) >= self.offload_size:
+            return await asyncio.to_thread(encoder, body)
+        return encoder(body)
+
+
+class _CompressingResponder:
+    """Buffers the start message until the body shows whether to compress"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            if self._never_compressed(message):
+                # Send headers right away so event streams get their first byte early
+                self.passthrough = True
+                await self._send(message)
+            else:
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        if self.start_message is None:
+            # Start already sent on an earlier chunk
+            await self._send(message)
+            return
+
+        start, self.start_message = self.start_message, None
+        body = message.get("body", b"")
+
+        if message.get("more_body", False) or not self._should_compress(start, body):
+            # Streaming or small responses go out as they are
+            self.passthrough = True
+            await self._send(start)
+            await self._send(message)
+            return
+
+        compressed = await self.middleware.compress(self.encoding, body)
+        if len(compressed) >= len(body):
+            await self._send(start)
+            await self._send(message)
+            return
+
+        headers = self._rewrite_headers(start["headers"], len(compressed))
+        await self._send({**start, "headers": headers})
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    @staticmethod
+    def _never_compressed(start) -> bool:
+        """Event streams and already encoded responses are passed through"""
+        for name, value in start.get("headers", []):
+            name = name.lower()
+            if name == b"content-encoding":
+                return True
+            if name == b"content-type" and value.lower().startswith(b"text/event-stream"):
+                return True
+        return False
+
+    def _should_compress(self, start, body: bytes) -> bool:
+        if len(body) < self.middleware.minimum_size:
+            return False
+        content_type = b""
+        for name, value in start.get("headers", []):
+            name = name.lower()
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.lower()
+        content_type = content_type.decode("latin-1")
+        return any(content_type.startswith(t) for t in COMPRESSIBLE_TYPES)
+
+    def _rewrite_headers(self, raw_headers, length: int) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (name, value) for name, value in raw_headers
+            if name.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [value for name, value in raw_headers if name.lower() == b"vary"]
+        vary.append(b"Accept-Encoding")
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        headers.append((b"content-length", str(length).encode("latin-1")))
+        headers.append((b"vary", b", ".join(vary)))
+        return headers
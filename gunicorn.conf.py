@@ -0,0 +1,34 @@
+"""
+Gunicorn configuration for the MCP Server
+
+With --preload the app (tool manifest, MCPServer) is built once in the
+master and inherited by every worker. The garbage collector writes to the
+header of each object it visits, which would copy those shared pages into
+every worker, so the master's objects are frozen out of collection before
+forking.
+
+Each worker also gets a stable slot number, reused by its replacement, so
+a worker restores the uploads and search index its slot persisted (see
+MCP_INDEX_PATH).
+"""
+
+import gc
+import itertools
+import os
+
+# Collections in the master would free objects and leave holes in pages that
+# workers later fill, copying them; collection stays off until fork
+gc.disable()
+
+
+def pre_fork(server, worker):
+    """Assign the lowest free slot and freeze everything the master built"""
+    taken = {getattr(other, "slot", None) for other in server.WORKERS.values()}
+    worker.slot = next(slot for slot in itertools.count() if slot not in taken)
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Collect normally in the worker; frozen objects are never scanned"""
+    os.environ["MCP_WORKER_SLOT"] = str(worker.slot)
+    gc.enable()
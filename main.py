@@ -5,7 +5,7 @@ A basic Model Context Protocol server that can be extended with custom functiona
 
 import asyncio
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
 from dataclasses import dataclass
 import json
 import sys
@@ -15,6 +15,10 @@ import base64
 import mimetypes
 from pathlib import Path
 
+from pdf_text import PDFTextExtractor, content_hash
+from scheduler import SessionScheduler
+from search_index import DocumentSearch
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,12 +30,23 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+TOOL_MANIFEST_PATH = Path(__file__).parent / "tools.json"
+
+def load_tool_manifest(path: Path = TOOL_MANIFEST_PATH) -> Dict[str, Dict[str, Any]]:
+    """Load tool schemas keyed by tool name"""
+    with open(path, encoding="utf-8") as f:
+        return {tool["name"]: tool for tool in json.load(f)}
+
+# Read once per process so a preloading parent shares it with its workers
+TOOL_MANIFEST = load_tool_manifest()
+
 @dataclass
 class MCPRequest:
     """Represents an MCP request"""
     method: str
     params: Dict[str, Any]
     id: Optional[str] = None
+    session_id: Optional[str] = None
 
 @dataclass
 class MCPResponse:
@@ -40,6 +55,16 @@ class MCPResponse:
     error: Optional[Dict[str, Any]] = None
     id: Optional[str] = None
 
+@dataclass
+class ToolProgress:
+    """Progress update yielded by a streaming tool"""
+    progress: float
+    total: Optional[float] = None
+    message: Optional[str] = None
+
+# Callback used by transports to push JSON-RPC notifications to the client
+Notifier = Callable[[Dict[str, Any]], Awaitable[None]]
+
 class MCPServer:
     """
     Placeholder MCP Server implementation
@@ -48,109 +73,51 @@ class MCPServer:
     You can extend this class to add your own tools and capabilities.
     """
     
-    def __init__(self):
+    def __init__(self, scheduler: Optional[SessionScheduler] = None,
+                 pdf_text: Optional[PDFTextExtractor] = None,
+                 search: Optional[DocumentSearch] = None):
         self.tools = {}
         self.resources = {}
         self.prompts = {}
         self.uploaded_files = {}  # Store uploaded PDF files
+        self.max_uploads = int(os.environ.get("MCP_MAX_UPLOADS", 0))  # 0 keeps every upload
+        self.scheduler = scheduler or SessionScheduler.from_env()
+        self.pdf_text = pdf_text or PDFTextExtractor.from_env()
+        self.search = search or DocumentSearch.from_env()
+        self._upload_count = 0
         self._setup_default_tools()
         self._setup_default_resources()
     
+    def restore_uploads(self):
+        """Restore the uploads persisted next to the search index (MCP_INDEX_PATH)
+        
+        Call once per process, from the event loop, before serving; under
+        gunicorn that is in each worker, after the fork. Restored uploads
+        missing from the index are indexed again.
+        """
+        restored = self.search.open()
+        # Oldest first, so eviction order survives the restart
+        for file_id in sorted(restored, key=lambda file_id: int(file_id.rsplit("_", 1)[-1])):
+            self.uploaded_files[file_id] = restored[file_id]
+            if file_id not in self.search.index.documents:
+                self.search.schedule_add(
+                    file_id, restored[file_id]["filename"],
+                    lambda file_id=file_id: self._index_upload(file_id)
+                )
+        # Uploads that failed to load keep their IDs and files for the next start
+        self._upload_count = max(
+            [int(file_id.rsplit("_", 1)[-1]) for file_id in self.search.uploads] or [0]
+        )
+    
+    async def close(self):
+        """Save pending search index changes"""
+        await self.search.close()
+    
     def _setup_default_tools(self):
-        """Setup default placeholder tools"""
-        self.tools = {
-            "echo": {
-                "name": "echo",
-                "description": "Echo back the input message",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {
-                            "type": "string",
-                            "description": "Message to echo back"
-                        }
-                    },
-                    "required": ["message"]
-                }
-            },
-            "get_time": {
-                "name": "get_time",
-                "description": "Get current server time",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
-            },
-            "add_numbers": {
-                "name": "add_numbers",
-                "description": "Add two floating point numbers together",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "a": {
-                            "type": "number",
-                            "description": "First number to add"
-                        },
-                        "b": {
-                            "type": "number",
-                            "description": "Second number to add"
-                        }
-                    },
-                    "required": ["a", "b"]
-                }
-            },
-            "multiply_numbers": {
-                "name": "multiply_numbers",
-                "description": "Multiply two floating point numbers",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "a": {
-                            "type": "number",
-                            "description": "First number to multiply"
-                        },
-                        "b": {
-                            "type": "number",
-                            "description": "Second number to multiply"
-                        }
-                    },
-                    "required": ["a", "b"]
-                }
-            },
-            "upload_pdf": {
-                "name": "upload_pdf",
-                "description": "Upload a PDF file for processing (validates PDF format)",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {
-                            "type": "string",
-                            "description": "Name of the PDF file"
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "Base64 encoded PDF content"
-                        }
-                    },
-                    "required": ["filename", "content"]
-                }
-            },
-            "placeholder_tool": {
-                "name": "placeholder_tool",
-                "description": "A placeholder tool for your custom implementation",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "input": {
-                            "type": "string",
-                            "description": "Input parameter for your custom tool"
-                        }
-                    },
-                    "required": ["input"]
-                }
-            }
-        }
+        """Setup default placeholder tools from the prebuilt manifest"""
+        # Schema objects are shared with the manifest. Handlers are inline in
+        # _stream_tool and _execute_tool; only pypdf loads later, on first extraction
+        self.tools = dict(TOOL_MANIFEST)
     
     def _setup_default_resources(self):
         """Setup default resources including PDF files"""
@@ -179,14 +146,36 @@ class MCPServer:
         except Exception:
             return False
     
+    async def _index_upload(self, file_id: str) -> Dict[int, str]:
+        """Extract every page of an upload for the search index"""
+        file_info = self.uploaded_files[file_id]
+        _, texts = await self.pdf_text.extract_in_background(file_info["content"], file_info["sha256"])
+        return texts
+    
+    async def _evict_upload(self, file_id: str):
+        """Drop an uploaded file together with its cached text and index entries"""
+        file_info = self.uploaded_files.pop(file_id, None)
+        if file_info is None:
+            return
+        shared = any(f["sha256"] == file_info["sha256"] for f in self.uploaded_files.values())
+        if not shared:
+            self.pdf_text.evict(file_info["sha256"])
+        await self.search.remove(file_id)
+        logger.info(f"Evicted uploaded file {file_id}")
+    
     def _get_fixed_pdf_path(self) -> Path:
         """Get path to the fixed PDF file"""
         # Look for sample.pdf in documents folder relative to server
         current_dir = Path(__file__).parent
         pdf_path = current_dir / "documents" / "sample.pdf"
         return pdf_path
-    async def handle_request(self, request: MCPRequest) -> MCPResponse:
-        """Handle incoming MCP requests"""
+    async def handle_request(self, request: MCPRequest, notify: Optional[Notifier] = None) -> MCPResponse:
+        """Handle incoming MCP requests
+        
+        ``notify`` is called with JSON-RPC notifications (progress and partial
+        content) emitted while the request runs, when the transport can
+        deliver them before the response.
+        """
         try:
             logger.info(f"Handling request: {request.method}")
             
@@ -195,7 +184,7 @@ class MCPServer:
             elif request.method == "tools/list":
                 return await self._handle_tools_list(request)
             elif request.method == "tools/call":
-                return await self._handle_tools_call(request)
+                return await self._handle_tools_call(request, notify)
             elif request.method == "resources/list":
                 return await self._handle_resources_list(request)
             elif request.method == "resources/read":
@@ -241,10 +230,12 @@ class MCPServer:
             id=request.id
         )
     
-    async def _handle_tools_call(self, request: MCPRequest) -> MCPResponse:
+    async def _handle_tools_call(self, request: MCPRequest, notify: Optional[Notifier] = None) -> MCPResponse:
         """Handle tools call request"""
         tool_name = request.params.get("name")
         arguments = request.params.get("arguments", {})
+        meta = request.params.get("_meta") or {}
+        progress_token = meta.get("progressToken")
         
         if tool_name not in self.tools:
             return MCPResponse(
@@ -252,14 +243,60 @@ class MCPServer:
                 id=request.id
             )
         
-        # Execute the tool
-        result = await self._execute_tool(tool_name, arguments)
+        async def run_tool() -> str:
+            chunks = []
+            async for chunk in self._stream_tool(tool_name, arguments):
+                if isinstance(chunk, ToolProgress):
+                    params = {"progressToken": progress_token, "progress": chunk.progress}
+                    if chunk.total is not None:
+                        params["total"] = chunk.total
+                    if chunk.message is not None:
+                        params["message"] = chunk.message
+                    method = "notifications/progress"
+                else:
+                    chunks.append(chunk)
+                    params = {
+                        "progressToken": progress_token,
+                        "content": [{"type": "text", "text": chunk}]
+                    }
+                    # Server extension, not an MCP method; see readme
+                    method = "notifications/tools/partialContent"
+                
+                # Notifications are opt-in through the request's progressToken
+                if notify is not None and progress_token is not None:
+                    await notify({"jsonrpc": "2.0", "method": method, "params": params})
+            return "".join(chunks)
+        
+        # Execute the tool, fairly scheduled against other sessions
+        result = await self.scheduler.run(request.session_id, run_tool)
         
         return MCPResponse(
             result={"content": [{"type": "text", "text": result}]},
             id=request.id
         )
     
+    async def _stream_tool(self, tool_name: str, arguments: Dict[str, Any]) -> AsyncIterator[Union[str, ToolProgress]]:
+        """Execute a tool, yielding text chunks and progress as they are produced
+        
+        Tools that finish in one go are run through ``_execute_tool`` and
+        yield their whole result as a single chunk.
+        """
+        if tool_name == "long_running_task":
+            try:
+                steps = min(max(int(arguments.get('steps', 5)), 1), 100)
+                interval = min(max(float(arguments.get('interval', 1.0)), 0.0), 10.0)
+            except (ValueError, TypeError) as e:
+                yield f"Error: Invalid argument - {str(e)}"
+                return
+            
+            for step in range(1, steps + 1):
+                await asyncio.sleep(interval)
+                yield ToolProgress(progress=step, total=steps, message=f"Step {step}/{steps}")
+                yield f"Step {step}/{steps} complete\n"
+        
+        else:
+            yield await self._execute_tool(tool_name, arguments)
+    
     async def _execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
         """Execute a tool with given arguments"""
         if tool_name == "echo":
@@ -306,19 +343,73 @@ class MCPServer:
                     return "Error: File is not a valid PDF format"
                 
                 # Store the uploaded file
-                file_id = f"uploaded_{len(self.uploaded_files) + 1}"
-                self.uploaded_files[file_id] = {
+                self._upload_count += 1
+                file_id = f"uploaded_{self._upload_count}"
+                digest = content_hash(content_bytes)
+                file_info = {
                     "filename": filename,
-                    "content": content_bytes,
                     "size": len(content_bytes),
+                    "sha256": digest,
                     "uploaded_at": datetime.now().isoformat()
                 }
+                self.uploaded_files[file_id] = {**file_info, "content": content_bytes}
+                await self.search.store_upload(file_id, file_info, content_bytes)
+                
+                # Pre-extract the text so pdf_extract_text is served from cache,
+                # then add it to the search index
+                self.pdf_text.schedule(content_bytes, digest)
+                indexed = self.search.schedule_add(file_id, filename, lambda: self._index_upload(file_id))
                 
-                return f"PDF uploaded successfully: {filename} (ID: {file_id}, Size: {len(content_bytes)} bytes)"
+                # Evict the oldest uploads beyond the configured limit
+                while self.max_uploads and len(self.uploaded_files) > self.max_uploads:
+                    await self._evict_upload(next(iter(self.uploaded_files)))
+                
+                message = f"PDF uploaded successfully: {filename} (ID: {file_id}, Size: {len(content_bytes)} bytes)"
+                if not indexed:
+                    message += " - search indexing is busy, this file will not appear in search_documents"
+                return message
                 
             except Exception as e:
                 return f"Error uploading PDF: {str(e)}"
         
+        elif tool_name == "pdf_extract_text":
+            file_id = arguments.get('file_id', '')
+            if file_id not in self.uploaded_files:
+                return f"Error: Uploaded file not found: {file_id}"
+            
+            file_info = self.uploaded_files[file_id]
+            try:
+                page_count, texts = await self.pdf_text.extract(
+                    file_info["content"], arguments.get('pages'), file_info["sha256"]
+                )
+            except ValueError as e:
+                return f"Error: {str(e)}"
+            except Exception as e:
+                return f"Error extracting PDF text: {str(e)}"
+            
+            sections = [f"--- Page {page} of {page_count} ---\n{text}" for page, text in texts.items()]
+            return f"{file_info['filename']} ({file_id})\n" + "\n".join(sections)
+        
+        elif tool_name == "search_documents":
+            query = arguments.get('query', '')
+            try:
+                limit = min(max(int(arguments.get('limit', 10)), 1), 100)
+            except (ValueError, TypeError) as e:
+                return f"Error: Invalid limit - {str(e)}"
+            
+            results = await self.search.search(query, limit)
+            if not results:
+                return f"No documents match: {query}"
+            
+            lines = [f"Documents matching: {query}"]
+            for rank, result in enumerate(results, start=1):
+                pages = ", ".join(str(p["page"]) for p in result["pages"])
+                lines.append(
+                    f"{rank}. {result['filename']} ({result['file_id']}) "
+                    f"score {result['score']:.3f}, pages {pages}"
+                )
+            return "\n".join(lines)
+        
         elif tool_name == "placeholder_tool":
             # TODO: Implement your custom tool logic here
             input_value = arguments.get('input', '')
@@ -435,6 +526,10 @@ class MCPStdioTransport:
     def __init__(self, server: MCPServer):
         self.server = server
     
+    async def _notify(self, notification: Dict[str, Any]):
+        """Write a JSON-RPC notification to stdout"""
+        print(json.dumps(notification), flush=True)
+    
     async def start(self):
         """Start the STDIO transport"""
         logger.info("Starting MCP server with STDIO transport")
@@ -455,11 +550,12 @@ class MCPStdioTransport:
                     request = MCPRequest(
                         method=request_data.get("method"),
                         params=request_data.get("params", {}),
-                        id=request_data.get("id")
+                        id=request_data.get("id"),
+                        session_id="stdio"
                     )
                     
-                    # Handle request
-                    response = await self.server.handle_request(request)
+                    # Handle request, writing notifications as they arrive
+                    response = await self.server.handle_request(request, self._notify)
                     
                     # Send response
                     response_data = {
@@ -487,8 +583,12 @@ class MCPStdioTransport:
 async def main():
     """Main entry point"""
     server = MCPServer()
+    server.restore_uploads()
     transport = MCPStdioTransport(server)
-    await transport.start()
+    try:
+        await transport.start()
+    finally:
+        await server.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
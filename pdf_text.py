@@ -0,0 +1,244 @@
+"""
+PDF text extraction with a per-page cache and background indexing
+
+Documents are parsed lazily with pypdf: opening a reader only loads the
+trailer and cross-reference table, and page content streams are decoded
+only for the pages requested. Extraction runs in thread pools so the event
+loop keeps serving requests, and the text of each page is cached by the
+SHA-256 of the document so repeated reads are served from memory.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: bytes) -> str:
+    """Cache key of a document"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def parse_page_ranges(spec: Optional[str], page_count: int) -> List[int]:
+    """Parse a 1-based page range spec such as "1-3,5,8-" into page numbers
+
+    An empty spec selects every page. Raises ValueError for malformed or
+    out-of-range specs.
+    """
+    if not spec or not spec.strip():
+        return list(range(1, page_count + 1))
+
+    pages: List[int] = []
+    seen = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start_text, _, end_text = part.partition("-")
+                start = int(start_text) if start_text.strip() else 1
+                end = int(end_text) if end_text.strip() else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+        if start < 1 or end > page_count or start > end:
+            raise ValueError(f"Page range {part} outside document (1-{page_count})")
+        for page in range(start, end + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    return pages
+
+
+def extract_pages(content: bytes, pages: Optional[str] = None,
+                  known: Collection[int] = ()) -> Tuple[int, Dict[int, str]]:
+    """Extract the text of the selected pages, skipping those in ``known``
+
+    Blocking; run it in an executor. Returns the page count and a
+    {page number: text} mapping.
+    """
+    # Imported on first use, in a pool thread, to keep server start lean
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(content))
+    page_count = len(reader.pages)
+    texts = {}
+    for page in parse_page_ranges(pages, page_count):
+        if page not in known:
+            texts[page] = reader.pages[page - 1].extract_text() or ""
+    return page_count, texts
+
+
+@dataclass
+class CachedDocument:
+    """Extracted text of one document"""
+    page_count: int
+    pages: Dict[int, str] = field(default_factory=dict)
+
+    def complete(self) -> bool:
+        return len(self.pages) == self.page_count
+
+
+class PDFTextExtractor:
+    """
+    Lazily extracts and caches per-page PDF text
+
+    On-demand extraction and background pre-extraction of new uploads run in
+    separate bounded thread pools, so indexing a burst of uploads never
+    delays an interactive pdf_extract_text call. At most ``max_pending``
+    background jobs are kept; beyond that uploads are extracted on demand.
+    The cache holds up to ``max_cached_pages`` pages and evicts whole
+    documents in least recently used order.
+    """
+
+    def __init__(self, workers: int = 2, background_workers: int = 1,
+                 max_pending: int = 16, max_cached_pages: int = 10000):
+        self.max_pending = max_pending
+        self.max_cached_pages = max_cached_pages
+        self.documents: "OrderedDict[str, CachedDocument]" = OrderedDict()
+        self.cached_pages = 0
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pdf-extract")
+        self._background_pool = ThreadPoolExecutor(
+            max_workers=max(1, background_workers), thread_name_prefix="pdf-index"
+        )
+        self._background: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def from_env(cls) -> "PDFTextExtractor":
+        """Build an extractor configured from MCP_PDF_* environment variables"""
+        return cls(
+            workers=int(os.environ.get("MCP_PDF_WORKERS", 2)),
+            background_workers=int(os.environ.get("MCP_PDF_BACKGROUND_WORKERS", 1)),
+            max_pending=int(os.environ.get("MCP_PDF_BACKGROUND_QUEUE", 16)),
+            max_cached_pages=int(os.environ.get("MCP_PDF_CACHE_PAGES", 10000)),
+        )
+
+    async def extract(self, content: bytes, pages: Optional[str] = None,
+                      digest: Optional[str] = None) -> Tuple[int, Dict[int, str]]:
+        """Return the page count and text of the selected pages
+
+        Raises ValueError for invalid page ranges and pypdf errors for
+        unreadable documents.
+        """
+        digest = digest or content_hash(content)
+
+        pending = self._background.get(digest)
+        if pending is not None:
+            # Reuse the running pre-extraction rather than parsing twice
+            await asyncio.shield(pending)
+
+        document = self.documents.get(digest)
+        if document is not None:
+            self.documents.move_to_end(digest)
+            wanted = parse_page_ranges(pages, document.page_count)
+            if all(page in document.pages for page in wanted):
+                return document.page_count, {page: document.pages[page] for page in wanted}
+            known = dict(document.pages)
+        else:
+            known = {}
+
+        loop = asyncio.get_running_loop()
+        page_count, texts = await loop.run_in_executor(
+            self._pool, extract_pages, content, pages, set(known)
+        )
+        # The cached pages may have been evicted meanwhile; store them again
+        document = self._store(digest, page_count, {**known, **texts})
+        wanted = parse_page_ranges(pages, page_count)
+        return page_count, {page: document.pages[page] for page in wanted}
+
+    async def extract_in_background(self, content: bytes,
+                                    digest: Optional[str] = None) -> Tuple[int, Dict[int, str]]:
+        """Return the page count and text of every page, for indexing
+
+        Runs on the background pool, joining a pre-extraction that is
+        already running, so indexing never takes an interactive worker.
+        """
+        digest = digest or content_hash(content)
+
+        pending = self._background.get(digest)
+        if pending is not None:
+            await asyncio.shield(pending)
+
+        document = self.documents.get(digest)
+        if document is not None and document.complete():
+            self.documents.move_to_end(digest)
+            return document.page_count, dict(document.pages)
+        known = dict(document.pages) if document is not None else {}
+
+        loop = asyncio.get_running_loop()
+        page_count, texts = await loop.run_in_executor(
+            self._background_pool, extract_pages, content, None, set(known)
+        )
+        # The cached pages may have been evicted meanwhile; store them again
+        document = self._store(digest, page_count, {**known, **texts})
+        return page_count, dict(document.pages)
+
+    def schedule(self, content: bytes, digest: Optional[str] = None) -> bool:
+        """Pre-extract every page of a document in the background
+
+        Returns False when the document is already cached or queued, or the
+        background queue is full.
+        """
+        digest = digest or content_hash(content)
+        document = self.documents.get(digest)
+        if digest in self._background or (document is not None and document.complete()):
+            return False
+        if len(self._background) >= self.max_pending:
+            logger.info(f"PDF background queue full, {digest[:12]} will be extracted on demand")
+            return False
+
+        self._background[digest] = asyncio.get_running_loop().create_task(
+            self._extract_in_background(content, digest)
+        )
+        return True
+
+    async def _extract_in_background(self, content: bytes, digest: str):
+        try:
+            document = self.documents.get(digest)
+            known = dict(document.pages) if document is not None else {}
+            loop = asyncio.get_running_loop()
+            page_count, texts = await loop.run_in_executor(
+                self._background_pool, extract_pages, content, None, set(known)
+            )
+            self._store(digest, page_count, {**known, **texts})
+        except Exception as e:
+            logger.error(f"Background PDF extraction failed for {digest[:12]}: {e}")
+        finally:
+            self._background.pop(digest, None)
+
+    def _store(self, digest: str, page_count: int, texts: Dict[int, str]) -> CachedDocument:
+        document = self.documents.get(digest)
+        if document is None:
+            document = CachedDocument(page_count=page_count)
+            self.documents[digest] = document
+        for page, text in texts.items():
+            if page not in document.pages:
+                document.pages[page] = text
+                self.cached_pages += 1
+        self.documents.move_to_end(digest)
+
+        # Evict least recently used documents, never the one just stored
+        while self.cached_pages > self.max_cached_pages and len(self.documents) > 1:
+            _, evicted = self.documents.popitem(last=False)
+            self.cached_pages -= len(evicted.pages)
+        return document
+
+    def evict(self, digest: str) -> None:
+        """Drop a document from the cache"""
+        document = self.documents.pop(digest, None)
+        if document is not None:
+            self.cached_pages -= len(document.pages)
+
+    async def wait_idle(self) -> None:
+        """Wait for all background extraction to finish"""
+        while self._background:
+            await asyncio.gather(*list(self._background.values()), return_exceptions=True)
@@ -0,0 +1,287 @@
+"""
+Per-session fair scheduling of tool calls
+
+Tool executions are admitted through a SessionScheduler so that a single
+session flooding tools/call cannot starve the other sessions sharing the
+worker. Sessions are served by start-time weighted fair queuing, and each
+session is additionally bounded by a concurrency limit and a token bucket.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+
+@dataclass
+class TokenBucket:
+    """Token bucket rate limiter (rate <= 0 disables limiting)"""
+    rate: float
+    burst: float
+    tokens: float = 0.0
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.tokens = self.burst
+
+    def refill(self, now: float) -> None:
+        """Add the tokens accrued since the last refill"""
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self) -> bool:
+        """Whether a token can be taken right now"""
+        return self.rate <= 0 or self.tokens >= 1.0
+
+    def take(self) -> None:
+        """Consume one token"""
+        if self.rate > 0:
+            self.tokens -= 1.0
+
+    def wait_time(self) -> float:
+        """Seconds until the next token becomes available"""
+        if self.available():
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        """Whether the bucket is back at its burst size"""
+        return self.rate <= 0 or self.tokens >= self.burst
+
+
+@dataclass
+class SessionState:
+    """Scheduling state kept for one session"""
+    session_id: str
+    weight: float
+    max_concurrency: int
+    bucket: TokenBucket
+    queue: Deque[Tuple[float, asyncio.Future]] = field(default_factory=deque)
+    in_flight: int = 0
+    last_finish: float = 0.0
+
+    def idle(self) -> bool:
+        """Whether the session has no queued or running work"""
+        return not self.queue and self.in_flight == 0
+
+
+class SessionScheduler:
+    """
+    Weighted fair scheduler for tool executions across sessions
+
+    At most ``max_concurrency`` tool calls run at once. Each queued call is
+    tagged with a virtual start time ``max(vtime, last_finish)`` and the
+    eligible call with the smallest tag runs next, so sessions share the
+    slots in proportion to their weight regardless of how much work they
+    have queued. A session is eligible only while it is below its own
+    concurrency limit and has a token in its bucket.
+    """
+
+    sweep_interval = 1.0
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        session_concurrency: int = 4,
+        session_rate: float = 0.0,
+        session_burst: float = 10.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.session_concurrency = max(1, session_concurrency)
+        self.session_rate = session_rate
+        self.session_burst = max(1.0, session_burst)
+        self.sessions: Dict[str, SessionState] = {}
+        self.weights: Dict[str, float] = {}
+        self.in_flight = 0
+        self.vtime = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "SessionScheduler":
+        """Build a scheduler configured from MCP_* environment variables"""
+        return cls(
+            max_concurrency=int(os.environ.get("MCP_TOOL_CONCURRENCY", 8)),
+            session_concurrency=int(os.environ.get("MCP_SESSION_CONCURRENCY", 4)),
+            session_rate=float(os.environ.get("MCP_SESSION_RATE", 0)),
+            session_burst=float(os.environ.get("MCP_SESSION_BURST", 10)),
+        )
+
+    def set_weight(self, session_id: str, weight: float) -> None:
+        """Set the fair-share weight of a session (default 1.0)"""
+        if weight <= 0:
+            raise ValueError("Session weight must be positive")
+        self.weights[session_id] = weight
+        if session_id in self.sessions:
+            self.sessions[session_id].weight = weight
+
+    def _session(self, session_id: str) -> SessionState:
+        state = self.sessions.get(session_id)
+        if state is None:
+            self._sweep()
+            state = SessionState(
+                session_id=session_id,
+                weight=self.weights.get(session_id, 1.0),
+                max_concurrency=self.session_concurrency,
+                bucket=TokenBucket(rate=self.session_rate, burst=self.session_burst),
+            )
+            self.sessions[session_id] = state
+        return state
+
+    async def run(self, session_id: Optional[str], func: Callable[[], Awaitable[Any]]) -> Any:
+        """Wait for a slot fairly, then await ``func()`` and return its result"""
+        state = self._session(session_id or DEFAULT_SESSION_ID)
+        start_tag = max(self.vtime, state.last_finish)
+        state.last_finish = start_tag + 1.0 / state.weight
+
+        future = asyncio.get_running_loop().create_future()
+        state.queue.append((start_tag, future))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # Still queued: withdraw the entry
+                state.queue = deque(item for item in state.queue if item[1] is not future)
+                self._release_if_idle(state)
+            else:
+                # Slot was granted just as we were cancelled: hand it back
+                self._finish(state)
+            raise
+
+        try:
+            return await func()
+        finally:
+            self._finish(state)
+
+    def _finish(self, state: SessionState) -> None:
+        state.in_flight -= 1
+        self.in_flight -= 1
+        self._release_if_idle(state)
+        self._dispatch()
+
+    def _release_if_idle(self, state: SessionState) -> None:
+        """Forget sessions with no pending work and a full bucket"""
+        state.bucket.refill(time.monotonic())
+        if state.idle() and state.bucket.full():
+            self.sessions.pop(state.session_id, None)
+
+    def _sweep(self) -> None:
+        """Forget idle sessions whose buckets have refilled since they finished
+
+        Rate-limited sessions are rarely full right after their last call, so
+        they are collected here, at most once per ``sweep_interval``, when
+        new sessions arrive.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for state in list(self.sessions.values()):
+            if state.idle():
+                self._release_if_idle(state)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the eligible queued calls with the smallest tags"""
+        now = time.monotonic()
+        next_wakeup: Optional[float] = None
+
+        while self.in_flight < self.max_concurrency:
+            best: Optional[SessionState] = None
+            for state in self.sessions.values():
+                if not state.queue or state.in_flight >= state.max_concurrency:
+                    continue
+                state.bucket.refill(now)
+                if not state.bucket.available():
+                    wait = state.bucket.wait_time()
+                    next_wakeup = wait if next_wakeup is None else min(next_wakeup, wait)
+                    continue
+                if best is None or state.queue[0][0] < best.queue[0][0]:
+                    best = state
+            if best is None:
+                break
+
+            start_tag, future = best.queue.popleft()
+            if future.done():
+                continue
+            self.vtime = max(self.vtime, start_tag)
+            best.bucket.take()
+            best.in_flight += 1
+            self.in_flight += 1
+            future.set_result(None)
+
+        if next_wakeup is not None and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(next_wakeup, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of scheduler occupancy for diagnostics"""
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "sessions": {
+                sid: {"queued": len(s.queue), "in_flight": s.in_flight, "weight": s.weight}
+                for sid, s in self.sessions.items()
+            },
+        }
+
+
+class RateLimiter:
+    """
+    Token bucket per key, such as new sessions per client address
+
+    Buckets that have refilled are forgotten, at most once per
+    ``sweep_interval``, so idle keys cost no memory.
+    """
+
+    sweep_interval = 1.0
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def for_sessions(cls) -> "RateLimiter":
+        """Limit on new sessions per client address from MCP_NEW_SESSION_* variables"""
+        return cls(
+            rate=float(os.environ.get("MCP_NEW_SESSION_RATE", 1)),
+            burst=float(os.environ.get("MCP_NEW_SESSION_BURST", 10)),
+        )
+
+    def allow(self, key: str) -> bool:
+        """Take a token for ``key``, returning False when its bucket is empty"""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self._sweep(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate=self.rate, burst=self.burst)
+        bucket.refill(now)
+        if not bucket.available():
+            return False
+        bucket.take()
+        return True
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.full():
+                del self.buckets[key]
@@ -0,0 +1,642 @@
+"""
+Incremental full-text search over uploaded documents
+
+SearchIndex is an in-process inverted index ranking pages with BM25. Each
+term's postings are two parallel ``array('I')`` columns (page ids and term
+frequencies), which keeps memory compact and lets the index be written to
+disk as raw arrays and mapped back with mmap: a loaded index only touches
+the postings of the terms that are actually queried.
+
+DocumentSearch wraps an index for the server. All index operations run on
+one dedicated thread, so updates, queries and saves never block the event
+loop or race each other.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MCPIDX01"
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MAX_TERM_LENGTH = 64
+
+Postings = Tuple[Union[array, memoryview], Union[array, memoryview]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase index terms"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+
+class SearchIndex:
+    """
+    Inverted index of document pages ranked with BM25
+
+    Pages are numbered with increasing ids as they are added, so postings
+    stay sorted and additions are plain appends. Removing a document
+    tombstones its pages; they are dropped from the postings when the index
+    is saved, or by an in-memory compaction once they make up a large share
+    of an index that is not mapped from a file.
+    """
+
+    # Terms on more pages than this are treated as near-stopwords by search
+    max_scanned_postings = 4096
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # Page id -> (file_id, page number); None once removed
+        self.pages: List[Optional[Tuple[str, int]]] = []
+        self.lengths = array("I")
+        self.documents: Dict[str, List[int]] = {}
+        self.filenames: Dict[str, str] = {}
+        # Caller data saved with the index
+        self.metadata: Dict[str, Any] = {}
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.live_pages = 0
+        self.total_length = 0
+        # Distinct terms of each document added in this process
+        self.document_terms: Dict[str, List[str]] = {}
+        # Tombstoned entries per term, so idf uses the live document frequency
+        self._dead_postings: Dict[str, int] = {}
+        # Postings still backed by a mapped index file: term -> (offset, count)
+        self._mapped_terms: Dict[str, Tuple[int, int]] = {}
+        self._mapped: Optional[memoryview] = None
+
+    def __len__(self) -> int:
+        return self.live_pages
+
+    def add_document(self, file_id: str, filename: str, pages: Dict[int, str]) -> None:
+        """Index the text of a document's pages, replacing any previous version"""
+        if file_id in self.documents:
+            self.remove_document(file_id)
+
+        page_ids = []
+        document_terms = set()
+        for page, text in sorted(pages.items()):
+            page_id = len(self.pages)
+            frequencies: Dict[str, int] = {}
+            tokens = tokenize(text)
+            for term in tokens:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, frequency in frequencies.items():
+                ids, tfs = self._writable_postings(term)
+                ids.append(page_id)
+                tfs.append(frequency)
+            document_terms.update(frequencies)
+
+            self.pages.append((file_id, page))
+            self.lengths.append(len(tokens))
+            self.live_pages += 1
+            self.total_length += len(tokens)
+            page_ids.append(page_id)
+
+        self.documents[file_id] = page_ids
+        self.filenames[file_id] = filename
+        self.document_terms[file_id] = list(document_terms)
+
+    def remove_document(self, file_id: str) -> bool:
+        """Remove a document from the index"""
+        page_ids = self.documents.pop(file_id, None)
+        self.filenames.pop(file_id, None)
+        terms = self.document_terms.pop(file_id, None)
+        if page_ids is None:
+            return False
+
+        if page_ids:
+            # A document's pages are consecutive ids; documents mapped from a
+            # file have no term list, so every term is probed for them
+            first, last = page_ids[0], page_ids[-1]
+            for term in self.terms() if terms is None else terms:
+                ids = self.get_postings(term)[0]
+                dead = bisect_right(ids, last) - bisect_left(ids, first)
+                if dead:
+                    self._dead_postings[term] = self._dead_postings.get(term, 0) + dead
+
+        for page_id in page_ids:
+            self.pages[page_id] = None
+            self.live_pages -= 1
+            self.total_length -= self.lengths[page_id]
+
+        # Mapped indexes are compacted when they are next saved
+        if self._mapped is None and len(self.pages) - self.live_pages > max(1024, len(self.pages) // 4):
+            self.compact()
+        return True
+
+    def _writable_postings(self, term: str) -> Tuple[array, array]:
+        postings = self.postings.get(term)
+        if postings is None:
+            # Copy mapped postings into memory before appending to them
+            ids, tfs = self._mapped_postings(term) or ((), ())
+            postings = (array("I", ids), array("I", tfs))
+            self.postings[term] = postings
+            self._mapped_terms.pop(term, None)
+        return postings
+
+    def _mapped_postings(self, term: str) -> Optional[Postings]:
+        location = self._mapped_terms.get(term)
+        if location is None:
+            return None
+        offset, count = location
+        start = offset * 4
+        ids = self._mapped[start:start + count * 4].cast("I")
+        tfs = self._mapped[start + count * 4:start + count * 8].cast("I")
+        return ids, tfs
+
+    def get_postings(self, term: str) -> Optional[Postings]:
+        """Page ids and term frequencies of a term, possibly tombstoned"""
+        return self.postings.get(term) or self._mapped_postings(term)
+
+    def terms(self) -> List[str]:
+        """Every term in the index"""
+        return list(self.postings) + list(self._mapped_terms)
+
+    def search(self, query: str, limit: int = 10, pages_per_document: int = 3) -> List[Dict[str, Any]]:
+        """Rank documents by the BM25 score of their best matching page
+
+        Query terms are evaluated rarest first (MaxScore). Once no page
+        outside the current candidates could reach the top ``limit``
+        documents on the remaining terms' maximum contribution, those terms
+        only probe the candidates' postings instead of being scanned, so the
+        cost follows the rare terms rather than the common ones.
+
+        Near-stopwords, terms on more than ``max_scanned_postings`` pages,
+        are never scanned in full: once ``limit`` documents match they only
+        rescore those candidates, and when they come first only their
+        newest ``max_scanned_postings`` pages are scored. Their low idf
+        makes the ranking this misses small, and it bounds query cost.
+        """
+        if not self.live_pages or limit < 1:
+            return []
+
+        k1, b, lengths, pages = self.k1, self.b, self.lengths, self.pages
+        average_length = self.total_length / self.live_pages or 1.0
+        cap = self.max_scanned_postings
+
+        terms = []
+        for term in set(tokenize(query)):
+            postings = self.get_postings(term)
+            if postings is not None:
+                df = len(postings[0]) - self._dead_postings.get(term, 0)
+                if df <= 0:
+                    continue
+                idf = math.log(1.0 + (self.live_pages - df + 0.5) / (df + 0.5))
+                terms.append((idf, df, postings))
+        # Rarest first; idf * (k1 + 1) bounds a term's contribution to any page
+        terms.sort(key=lambda item: item[0], reverse=True)
+        remaining_bound = sum(idf * (k1 + 1.0) for idf, _, _ in terms)
+
+        scores: Dict[int, float] = {}
+        pruning = False
+        for position, (idf, df, (ids, tfs)) in enumerate(terms):
+            remaining_bound -= idf * (k1 + 1.0)
+            scale = idf * (k1 + 1.0)
+            norm_base, norm_length = k1 * (1.0 - b), k1 * b / average_length
+            if df > cap and not pruning:
+                # A near-stopword: rescore the candidates once the top is full,
+                # otherwise score only its newest pages
+                pruning = self._kth_document_score(scores, limit) > 0.0
+                if not pruning:
+                    ids, tfs = ids[-cap:], tfs[-cap:]
+
+            if not pruning:
+                for page_id, tf in zip(ids, tfs):
+                    if pages[page_id] is not None:
+                        scores[page_id] = scores.get(page_id, 0.0) + scale * tf / (
+                            tf + norm_base + norm_length * lengths[page_id])
+                # New pages can be ignored once the remaining terms cannot
+                # lift one above the current limit-th best document
+                if position + 1 < len(terms):
+                    pruning = self._kth_document_score(scores, limit) >= remaining_bound
+                continue
+
+            # Probe the candidates: scan the postings from the first candidate
+            # on, or binary search each candidate, whichever reads fewer entries
+            start = bisect_left(ids, min(scores)) if scores else len(ids)
+            if len(ids) - start <= len(scores) * 16:
+                for page_id, tf in zip(ids[start:], tfs[start:]):
+                    if page_id in scores:
+                        scores[page_id] += scale * tf / (tf + norm_base + norm_length * lengths[page_id])
+            else:
+                for page_id in scores:
+                    found = bisect_left(ids, page_id, start)
+                    if found < len(ids) and ids[found] == page_id:
+                        tf = tfs[found]
+                        scores[page_id] += scale * tf / (tf + norm_base + norm_length * lengths[page_id])
+
+        best: Dict[str, float] = {}
+        for page_id, score in scores.items():
+            file_id = pages[page_id][0]
+            if score > best.get(file_id, 0.0):
+                best[file_id] = score
+
+        results = []
+        for file_id, score in heapq.nlargest(limit, best.items(), key=lambda item: item[1]):
+            matches = [
+                (scores[page_id], pages[page_id][1])
+                for page_id in self.documents[file_id] if page_id in scores
+            ]
+            results.append({
+                "file_id": file_id,
+                "filename": self.filenames.get(file_id, ""),
+                "score": score,
+                "pages": [
+                    {"page": page, "score": page_score}
+                    for page_score, page in heapq.nlargest(pages_per_document, matches)
+                ]
+            })
+        return results
+
+    def _kth_document_score(self, scores: Dict[int, float], k: int) -> float:
+        """Score of the k-th best document by its best page, 0 if fewer match"""
+        best: Dict[str, float] = {}
+        for page_id, score in scores.items():
+            file_id = self.pages[page_id][0]
+            if score > best.get(file_id, 0.0):
+                best[file_id] = score
+        if len(best) < k:
+            return 0.0
+        return heapq.nlargest(k, best.values())[-1]
+
+    def _live_page_ids(self) -> Dict[int, int]:
+        """Old page id -> compacted page id of every live page"""
+        remap = {}
+        for page_id, location in enumerate(self.pages):
+            if location is not None:
+                remap[page_id] = len(remap)
+        return remap
+
+    def _compacted_postings(self, term: str, remap: Dict[int, int]) -> Tuple[array, array]:
+        """One term's postings without tombstoned pages, renumbered by ``remap``"""
+        ids, tfs = self.get_postings(term)
+        new_ids, new_tfs = array("I"), array("I")
+        for page_id, tf in zip(ids, tfs):
+            new_id = remap.get(page_id)
+            if new_id is not None:
+                new_ids.append(new_id)
+                new_tfs.append(tf)
+        return new_ids, new_tfs
+
+    def compact(self) -> None:
+        """Renumber live pages and drop tombstoned postings in memory
+
+        This copies every postings list onto the heap; mapped indexes are
+        compacted by ``save`` instead, which streams them to the new file.
+        """
+        remap = self._live_page_ids()
+        postings = {}
+        for term in self.terms():
+            new_ids, new_tfs = self._compacted_postings(term, remap)
+            if new_ids:
+                postings[term] = (new_ids, new_tfs)
+
+        self.pages = [location for location in self.pages if location is not None]
+        self.lengths = array("I", (self.lengths[page_id] for page_id in remap))
+        self.postings = postings
+        self._dead_postings = {}
+        self._mapped_terms = {}
+        self._mapped = None
+        self.documents = {
+            file_id: [remap[page_id] for page_id in page_ids]
+            for file_id, page_ids in self.documents.items()
+        }
+
+    def save(self, path: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Write the index to ``path`` atomically, then map it from there
+
+        Layout: magic, header length, JSON header (pages, filenames, caller
+        ``metadata`` and a term -> (offset, count) directory), padding to 4
+        bytes, then each term's page ids followed by its term frequencies as
+        raw uint32. Tombstoned pages are left out one term at a time, so
+        mapped postings are never copied onto the heap as a whole. Only one
+        process may write a given path.
+        """
+        remap = self._live_page_ids()
+        compacting = len(remap) != len(self.pages)
+        terms = []
+        directory = {}
+        offset = 0
+        for term in self.terms():
+            ids, _ = self.get_postings(term)
+            count = sum(1 for page_id in ids if page_id in remap) if compacting else len(ids)
+            if count:
+                terms.append(term)
+                directory[term] = [offset, count]
+                offset += count * 2
+
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "pages": [location for location in self.pages if location is not None],
+            "lengths": [self.lengths[page_id] for page_id in remap],
+            "filenames": self.filenames,
+            "metadata": self.metadata if metadata is None else metadata,
+            "terms": directory,
+        }, separators=(",", ":")).encode("utf-8")
+        padding = -(len(MAGIC) + 4 + len(header)) % 4
+
+        # A temp file of our own in the same directory, so os.replace is atomic
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<I", len(header)))
+                f.write(header)
+                f.write(b" " * padding)
+                for term in terms:
+                    ids, tfs = self._compacted_postings(term, remap) if compacting else self.get_postings(term)
+                    f.write(ids)
+                    f.write(tfs)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Release the heap postings and share the file's pages instead
+        self._map(path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SearchIndex":
+        """Map an index file written by ``save``; postings stay on disk until used"""
+        index = cls(**kwargs)
+        index._map(path)
+        return index
+
+    def _map(self, path: str) -> None:
+        """Replace the contents of this index with the mapped file at ``path``"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(mapped)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a search index file: {path}")
+        (header_length,) = struct.unpack("<I", view[len(MAGIC):len(MAGIC) + 4])
+        header_end = len(MAGIC) + 4 + header_length
+        header = json.loads(bytes(view[len(MAGIC) + 4:header_end]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Search index {path} was written with {header['byteorder']} byte order")
+
+        self.pages = [tuple(location) for location in header["pages"]]
+        self.lengths = array("I", header["lengths"])
+        self.filenames = header["filenames"]
+        self.metadata = header.get("metadata", {})
+        self.documents = {}
+        for page_id, (file_id, _) in enumerate(self.pages):
+            self.documents.setdefault(file_id, []).append(page_id)
+        self.live_pages = len(self.pages)
+        self.total_length = sum(self.lengths)
+        self.postings = {}
+        self._dead_postings = {}
+        self._mapped = view[header_end + (-header_end % 4):]
+        self._mapped_terms = {term: tuple(location) for term, location in header["terms"].items()}
+
+
+class DocumentSearch:
+    """
+    Search index shared by the server
+
+    Index updates, queries and saves are serialized on a single worker
+    thread. When ``path`` is set, ``open`` restores the index and the
+    uploads behind it, each upload's content is written to
+    ``{path}.uploads/`` as it arrives, and the index is saved back together
+    with the upload metadata ``save_delay`` seconds after the last change.
+
+    Each path has a single writer. Under gunicorn every worker keeps its
+    own uploads, so worker slot N (``MCP_WORKER_SLOT``, assigned in
+    gunicorn.conf.py) owns ``{path}.N``; a lock file keeps a second process
+    from writing the same path.
+    """
+
+    def __init__(self, path: Optional[str] = None, save_delay: float = 5.0, max_pending: int = 64):
+        self.configured_path = path
+        # Set by open once this process owns the path; None keeps everything in memory
+        self.path: Optional[str] = None
+        self.save_delay = save_delay
+        self.max_pending = max_pending
+        self.index = SearchIndex()
+        # Upload metadata saved with the index: file_id -> filename, size, ...
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self._lock_file = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._save_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "DocumentSearch":
+        """Build the search index configured from MCP_INDEX_* environment variables"""
+        return cls(
+            path=os.environ.get("MCP_INDEX_PATH") or None,
+            save_delay=float(os.environ.get("MCP_INDEX_SAVE_DELAY", 5)),
+            max_pending=int(os.environ.get("MCP_INDEX_QUEUE", 64)),
+        )
+
+    @property
+    def upload_dir(self) -> str:
+        return f"{self.path}.uploads"
+
+    def _upload_path(self, file_id: str) -> str:
+        return os.path.join(self.upload_dir, f"{file_id}.pdf")
+
+    def open(self) -> Dict[str, Dict[str, Any]]:
+        """Take ownership of ``path`` and restore the uploads saved there
+
+        Returns the upload metadata keyed by file id, with ``content`` read
+        from the upload directory. Index entries whose upload could not be
+        restored are dropped, so search never lists a file that cannot be
+        read; the upload itself stays on disk until it is evicted. Blocking;
+        call it once per process before serving requests.
+        """
+        path = self.configured_path
+        if not path:
+            return {}
+        slot = os.environ.get("MCP_WORKER_SLOT")
+        if slot:
+            path = f"{path}.{slot}"
+        if not self._lock(path):
+            logger.error(f"Search index {path} is owned by another process, keeping uploads in memory")
+            return {}
+        self.path = path
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        if os.path.exists(self.path):
+            try:
+                self.index = SearchIndex.load(self.path)
+            except Exception as e:
+                logger.error(f"Could not load search index from {self.path}: {e}")
+
+        saved = self.index.metadata.get("uploads", {})
+        restored = {}
+        for file_id, info in saved.items():
+            try:
+                restored[file_id] = {**info, "content": _read_file(self._upload_path(file_id))}
+            except OSError as e:
+                # Kept on disk and in the saved metadata for the next start
+                logger.error(f"Could not restore upload {file_id}: {e}")
+        for file_id in list(self.index.documents):
+            if file_id not in restored:
+                self.index.remove_document(file_id)
+        # Content written by a process that stopped before saving its index
+        for name in os.listdir(self.upload_dir):
+            if name[:-len(".pdf")] not in saved:
+                os.unlink(os.path.join(self.upload_dir, name))
+
+        self.uploads = dict(saved)
+        logger.info(f"Restored {len(restored)} uploads and {len(self.index)} indexed pages from {self.path}")
+        return restored
+
+    def _lock(self, path: str) -> bool:
+        """Hold an exclusive lock on ``path`` until ``close``"""
+        if fcntl is None:
+            return True
+        lock_file = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def close(self) -> None:
+        """Save pending changes now and release ``path``"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        if self.path:
+            # Queued behind any save already running on the index thread
+            await self._save()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.path = None
+
+    async def store_upload(self, file_id: str, info: Dict[str, Any], content: bytes) -> None:
+        """Persist an upload so ``open`` restores it after a restart"""
+        if not self.path:
+            return
+        self.uploads[file_id] = info
+        await self._run(_write_file, self._upload_path(file_id), content)
+        self._schedule_save()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def schedule_add(self, file_id: str, filename: str,
+                     load_pages: Callable[[], Awaitable[Dict[int, str]]]) -> bool:
+        """Index a document once ``load_pages()`` has produced its page text
+
+        Returns False, leaving the document out of the index, when
+        ``max_pending`` documents are already waiting to be indexed.
+        """
+        if len(self._pending) >= self.max_pending:
+            logger.warning(f"Search indexing queue full, {file_id} will not be searchable")
+            return False
+        self._pending[file_id] = asyncio.get_running_loop().create_task(
+            self._add_when_ready(file_id, filename, load_pages)
+        )
+        return True
+
+    async def _add_when_ready(self, file_id: str, filename: str,
+                              load_pages: Callable[[], Awaitable[Dict[int, str]]]):
+        try:
+            await self.add(file_id, filename, await load_pages())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Could not index {file_id}: {e}")
+        finally:
+            if self._pending.get(file_id) is asyncio.current_task():
+                del self._pending[file_id]
+
+    async def add(self, file_id: str, filename: str, pages: Dict[int, str]) -> None:
+        """Add or replace a document in the index"""
+        await self._run(self.index.add_document, file_id, filename, pages)
+        self._schedule_save()
+
+    async def remove(self, file_id: str) -> None:
+        """Remove a document and its stored upload, cancelling pending indexing"""
+        pending = self._pending.pop(file_id, None)
+        if pending is not None:
+            pending.cancel()
+        removed = await self._run(self.index.remove_document, file_id)
+        if self.uploads.pop(file_id, None) is not None:
+            await self._run(_remove_file, self._upload_path(file_id))
+            removed = True
+        if removed:
+            self._schedule_save()
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Rank indexed documents against a query"""
+        return await self._run(self.index.search, query, limit)
+
+    def _schedule_save(self) -> None:
+        if self.path and self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            await asyncio.sleep(self.save_delay)
+            self._save_task = None
+            await self._save()
+        finally:
+            if self._save_task is asyncio.current_task():
+                self._save_task = None
+
+    async def _save(self):
+        try:
+            # Snapshot the metadata on the loop; the save runs on the index thread
+            metadata = {"uploads": dict(self.uploads)}
+            await self._run(self.index.save, self.path, metadata)
+        except Exception as e:
+            logger.error(f"Could not save search index to {self.path}: {e}")
+
+    async def wait_idle(self) -> None:
+        """Wait for pending indexing to finish"""
+        while self._pending:
+            await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, content: bytes) -> None:
+    """Write a file atomically"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -17,18 +17,30 @@ fi
 # Activate virtual environment
 source venv/bin/activate
 
-# Install/upgrade dependencies
-echo "Installing dependencies..."
-pip install --upgrade pip
-pip install -r requirements.txt
+# Install dependencies only when requirements.txt changed since the last boot
+REQUIREMENTS_STAMP="venv/.requirements.sha256"
+REQUIREMENTS_HASH=$(sha256sum requirements.txt | cut -d' ' -f1)
+if [ "$(cat "$REQUIREMENTS_STAMP" 2>/dev/null)" != "$REQUIREMENTS_HASH" ]; then
+    echo "Installing dependencies..."
+    pip install --disable-pip-version-check -r requirements.txt && \
+        echo "$REQUIREMENTS_HASH" > "$REQUIREMENTS_STAMP"
+else
+    echo "Dependencies up to date"
+fi
 
 # Set port from Azure environment variable
 export PORT=${PORT:-8000}
 
 echo "Starting server on port $PORT..."
 
+# The App Service front end appends the address of the client it accepted to
+# X-Forwarded-For; only that last entry is trusted to tell clients apart
+export MCP_TRUSTED_PROXY_HOPS=${MCP_TRUSTED_PROXY_HOPS:-1}
+
 # Start the application with gunicorn for production
+# (gunicorn.conf.py freezes the preloaded state before workers fork)
 exec gunicorn app:app \
+    --config gunicorn.conf.py \
     --bind 0.0.0.0:$PORT \
     --workers 4 \
     --worker-class uvicorn.workers.UvicornWorker \
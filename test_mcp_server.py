@@ -4,8 +4,22 @@ Basic tests for MCP Server
 
 import pytest
 import asyncio
+import base64
+import gzip
 import json
-from main import MCPServer, MCPRequest
+import subprocess
+import sys
+import time
+from pathlib import Path
+from fastapi import Request
+from fastapi.testclient import TestClient
+import app as web_app
+from compression import CompressionMiddleware, select_encoding
+from main import MCPServer, MCPRequest, TOOL_MANIFEST
+from pdf_text import PDFTextExtractor, content_hash, parse_page_ranges
+from scheduler import RateLimiter, SessionScheduler
+import search_index
+from search_index import DocumentSearch, SearchIndex
 
 class TestMCPServer:
     """Test cases for MCP Server"""
@@ -118,5 +132,836 @@ class TestMCPServer:
         assert response.error is not None
         assert response.error["code"] == -32601
 
+class TestSessionScheduler:
+    """Test cases for per-session fair scheduling"""
+    
+    @staticmethod
+    def p99(samples):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    
+    async def light_latencies(self, scheduler, count=20):
+        """Run sequential short calls for a light session and time them"""
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            await scheduler.run("light", lambda: asyncio.sleep(0.005))
+            latencies.append(time.perf_counter() - started)
+        return latencies
+    
+    @pytest.mark.asyncio
+    async def test_light_session_p99_flat_under_heavy_load(self):
+        """A heavy session saturating the server does not starve a light one"""
+        scheduler = SessionScheduler(max_concurrency=2, session_concurrency=2)
+        baseline = self.p99(await self.light_latencies(scheduler))
+        
+        # 300 x 10ms calls on 2 slots is a ~1.5s backlog ahead of the light session
+        heavy = [
+            asyncio.create_task(scheduler.run("heavy", lambda: asyncio.sleep(0.01)))
+            for _ in range(300)
+        ]
+        await asyncio.sleep(0)
+        loaded = self.p99(await self.light_latencies(scheduler))
+        
+        assert scheduler.sessions["heavy"].queue
+        assert loaded < baseline + 0.05
+        
+        for task in heavy:
+            task.cancel()
+        await asyncio.gather(*heavy, return_exceptions=True)
+        assert scheduler.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_session_concurrency_limit(self):
+        """A session never runs more calls than its concurrency limit"""
+        scheduler = SessionScheduler(max_concurrency=8, session_concurrency=2)
+        running = 0
+        peak = 0
+        
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.005)
+            running -= 1
+        
+        await asyncio.gather(*(scheduler.run("s", work) for _ in range(10)))
+        
+        assert peak == 2
+        assert "s" not in scheduler.sessions
+    
+    @pytest.mark.asyncio
+    async def test_session_token_bucket(self):
+        """Calls beyond the burst are paced at the session rate"""
+        scheduler = SessionScheduler(session_rate=50, session_burst=2)
+        
+        async def work():
+            return time.perf_counter()
+        
+        started = time.perf_counter()
+        finished = await asyncio.gather(*(scheduler.run("s", work) for _ in range(5)))
+        
+        # Two calls ride the burst, the remaining three wait ~20ms each
+        assert max(finished) - started >= 0.05
+    
+    @pytest.mark.asyncio
+    async def test_weighted_share(self):
+        """Queued sessions are served in proportion to their weight"""
+        scheduler = SessionScheduler(max_concurrency=1)
+        scheduler.set_weight("gold", 3)
+        order = []
+        
+        def record(name):
+            async def work():
+                order.append(name)
+            return work
+        
+        tasks = [scheduler.run("gold", record("gold")) for _ in range(6)]
+        tasks += [scheduler.run("bronze", record("bronze")) for _ in range(6)]
+        await asyncio.gather(*tasks)
+        
+        assert order[:8].count("gold") == 6
+    
+    @pytest.mark.asyncio
+    async def test_idle_rate_limited_sessions_are_swept(self):
+        """One-shot sessions are forgotten once their buckets refill"""
+        scheduler = SessionScheduler(session_rate=1000, session_burst=5)
+        scheduler.sweep_interval = 0
+        
+        async def work():
+            pass
+        
+        for i in range(1000):
+            await scheduler.run(f"one-shot-{i}", work)
+        await asyncio.sleep(0.01)
+        await scheduler.run("late", work)
+        
+        assert set(scheduler.sessions) <= {"one-shot-999", "late"}
+    
+    @pytest.mark.asyncio
+    async def test_tools_call_uses_session(self):
+        """tools/call requests are admitted through the server scheduler"""
+        server = MCPServer(scheduler=SessionScheduler(max_concurrency=1))
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "echo", "arguments": {"message": "hi"}},
+            id="sched-1",
+            session_id="client-a"
+        )
+        response = await server.handle_request(request)
+        
+        assert "hi" in response.result["content"][0]["text"]
+        assert server.scheduler.in_flight == 0
+
+class TestHTTPTransport:
+    """Test cases for the FastAPI transport"""
+    
+    @pytest.fixture
+    def client(self):
+        """Create a test client for the web app"""
+        return TestClient(web_app.app)
+    
+    def test_only_issued_session_ids_are_honoured(self, client):
+        """Session IDs come from initialize; made-up ones are rejected"""
+        response = client.post("/mcp", json={"jsonrpc": "2.0", "method": "initialize", "id": 1})
+        session_id = response.headers["Mcp-Session-Id"]
+        assert web_app.verify_session_id(session_id)
+        
+        ping = {"jsonrpc": "2.0", "method": "ping", "id": 2}
+        assert client.post("/mcp", json=ping, headers={"Mcp-Session-Id": session_id}).status_code == 200
+        assert client.post("/mcp", json=ping, headers={"Mcp-Session-Id": "heavy-1"}).status_code == 404
+        assert client.post("/mcp", json=ping).status_code == 200
+        
+        call = {"name": "echo", "arguments": {"message": "hi"}}
+        assert client.post("/tools/call", json=call, headers={"Mcp-Session-Id": "heavy-2"}).status_code == 404
+    
+    def test_new_sessions_are_rate_limited(self, client, monkeypatch):
+        """initialize cannot mint an unbounded number of sessions per client"""
+        monkeypatch.setattr(web_app, "session_limiter", RateLimiter(rate=0.01, burst=3))
+        initialize = {"jsonrpc": "2.0", "method": "initialize", "id": 1}
+
+        statuses = [client.post("/mcp", json=initialize).status_code for _ in range(5)]
+
+        assert statuses == [200, 200, 200, 429, 429]
+        assert client.post("/mcp", json=initialize).json()["error"]["code"] == -32002
+
+    def test_client_address_ignores_client_written_forwarded_entries(self, monkeypatch):
+        """Only the X-Forwarded-For entry appended by the trusted proxy counts"""
+        def address(forwarded, hops):
+            monkeypatch.setattr(web_app, "TRUSTED_PROXY_HOPS", hops)
+            scope = {
+                "type": "http",
+                "headers": [(b"x-forwarded-for", forwarded.encode())],
+                "client": ("10.0.0.1", 1234),
+            }
+            return web_app.client_address(Request(scope))
+
+        assert address("6.6.6.0, 203.0.113.7:50123", 1) == "203.0.113.7"
+        assert address("6.6.6.1, 203.0.113.7:50999", 1) == "203.0.113.7"
+        assert address("[2001:db8::1]:443", 1) == "2001:db8::1"
+        assert address("6.6.6.0", 0) == "10.0.0.1"
+        assert address("", 1) == "10.0.0.1"
+
+    @staticmethod
+    def stream_call(steps, interval, request_id=1):
+        return {
+            "jsonrpc": "2.0",
+            "method": "tools/call",
+            "params": {
+                "name": "long_running_task",
+                "arguments": {"steps": steps, "interval": interval},
+                "_meta": {"progressToken": "sse"}
+            },
+            "id": request_id
+        }
+    
+    def test_sse_event_order(self, client):
+        """Notifications stream in order and the response is the last event"""
+        response = client.post(
+            "/mcp", json=self.stream_call(2, 0),
+            headers={"Accept": "application/json, text/event-stream"}
+        )
+        assert response.headers["content-type"].startswith("text/event-stream")
+        
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        assert [e.get("method") for e in events] == [
+            "notifications/progress", "notifications/tools/partialContent",
+            "notifications/progress", "notifications/tools/partialContent",
+            None
+        ]
+        assert [e["params"]["progress"] for e in events if e.get("method") == "notifications/progress"] == [1, 2]
+        assert events[-1]["id"] == 1
+        assert events[-1]["result"]["content"][0]["text"] == "Step 1/2 complete\nStep 2/2 complete\n"
+    
+    def test_json_without_event_stream_accept(self, client):
+        """Clients that do not accept SSE get a plain JSON response"""
+        response = client.post("/mcp", json=self.stream_call(1, 0))
+        
+        assert response.headers["content-type"] == "application/json"
+        assert "Step 1/1 complete" in response.json()["result"]["content"][0]["text"]
+    
+    @pytest.mark.asyncio
+    async def test_sse_disconnect_cancels_tool(self):
+        """A client disconnecting mid-stream cancels the running tool"""
+        body = json.dumps(self.stream_call(100, 0.05)).encode()
+        disconnected = asyncio.Event()
+        requested = []
+        sent = []
+        
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+        
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and b"data:" in message.get("body", b""):
+                disconnected.set()
+        
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/mcp", "raw_path": b"/mcp",
+            "query_string": b"", "root_path": "", "client": ("127.0.0.1", 1234),
+            "server": ("testserver", 80),
+            "headers": [(b"content-type", b"application/json"), (b"accept", b"text/event-stream")]
+        }
+        
+        started = time.perf_counter()
+        await asyncio.wait_for(web_app.app(scope, receive, send), timeout=2)
+        await asyncio.sleep(0.05)
+        
+        # 100 steps of 50ms would take 5s; the stream ended at the first event
+        assert time.perf_counter() - started < 1
+        assert web_app.mcp_server.scheduler.in_flight == 0
+
+class TestToolStreaming:
+    """Test cases for streamed tool output and progress notifications"""
+    
+    @pytest.fixture
+    def server(self):
+        """Create a server instance for testing"""
+        return MCPServer()
+    
+    @pytest.mark.asyncio
+    async def test_progress_and_partial_content(self, server):
+        """A progressToken turns yielded chunks into notifications"""
+        notifications = []
+        
+        async def notify(notification):
+            notifications.append(notification)
+        
+        request = MCPRequest(
+            method="tools/call",
+            params={
+                "name": "long_running_task",
+                "arguments": {"steps": 3, "interval": 0},
+                "_meta": {"progressToken": "tok-1"}
+            },
+            id="stream-1"
+        )
+        response = await server.handle_request(request, notify)
+        
+        progress = [n["params"] for n in notifications if n["method"] == "notifications/progress"]
+        partial = [n["params"] for n in notifications if n["method"] == "notifications/tools/partialContent"]
+        assert [p["progress"] for p in progress] == [1, 2, 3]
+        assert all(p["total"] == 3 and p["progressToken"] == "tok-1" for p in progress)
+        assert [p["content"][0]["text"] for p in partial] == [
+            "Step 1/3 complete\n", "Step 2/3 complete\n", "Step 3/3 complete\n"
+        ]
+        assert response.result["content"][0]["text"] == "".join(
+            p["content"][0]["text"] for p in partial
+        )
+    
+    @pytest.mark.asyncio
+    async def test_no_notifications_without_progress_token(self, server):
+        """Without a progressToken only the final response is produced"""
+        notifications = []
+        
+        async def notify(notification):
+            notifications.append(notification)
+        
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "long_running_task", "arguments": {"steps": 2, "interval": 0}},
+            id="stream-2"
+        )
+        response = await server.handle_request(request, notify)
+        
+        assert notifications == []
+        assert "Step 2/2 complete" in response.result["content"][0]["text"]
+
+class TestCompression:
+    """Test cases for HTTP response compression"""
+    
+    @staticmethod
+    async def call(accept_encoding, chunks, content_type=b"application/json", **options):
+        """Run a fake ASGI app sending ``chunks`` through the middleware"""
+        async def app(scope, receive, send):
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", content_type), (b"content-length", b"0")]
+            })
+            for i, chunk in enumerate(chunks):
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": i < len(chunks) - 1
+                })
+        
+        sent = []
+        async def send(message):
+            sent.append(message)
+        
+        scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding)]}
+        await CompressionMiddleware(app, **options)(scope, None, send)
+        return dict(sent[0]["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+    
+    def test_select_encoding(self):
+        """Accept-Encoding q-values and server preference pick the encoding"""
+        encoders = {"zstd": None, "br": None, "gzip": None}
+        
+        assert select_encoding("gzip, deflate", encoders) == "gzip"
+        assert select_encoding("gzip, br", encoders) == "br"
+        assert select_encoding("zstd;q=0.5, gzip", encoders) == "gzip"
+        assert select_encoding("*", encoders) == "zstd"
+        assert select_encoding("identity", encoders) is None
+        assert select_encoding("gzip;q=0", encoders) is None
+    
+    @pytest.mark.asyncio
+    async def test_large_body_compressed(self):
+        """Bodies above the threshold are compressed, offloaded when large"""
+        body = json.dumps({"tools": ["schema"] * 20000}).encode()
+        headers, payload = await self.call(b"gzip", [body], minimum_size=1024, offload_size=1024)
+        
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"content-length"] == str(len(payload)).encode()
+        assert gzip.decompress(payload) == body
+    
+    @pytest.mark.asyncio
+    async def test_small_and_streamed_bodies_untouched(self):
+        """Small bodies and streamed (SSE) responses are not compressed"""
+        headers, payload = await self.call(b"gzip", [b"{}"], minimum_size=1024)
+        assert b"content-encoding" not in headers
+        assert payload == b"{}"
+        
+        chunks = [b"data: x\n\n" * 200, b"data: y\n\n" * 200]
+        headers, payload = await self.call(b"gzip", chunks, b"text/event-stream", minimum_size=1024)
+        assert b"content-encoding" not in headers
+        assert payload == b"".join(chunks)
+    
+    @pytest.mark.asyncio
+    async def test_event_stream_headers_sent_before_body(self):
+        """SSE response headers are not held back until the first event"""
+        first_event = asyncio.Event()
+        sent = []
+        
+        async def app(scope, receive, send):
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream; charset=utf-8")]
+            })
+            await first_event.wait()
+            await send({"type": "http.response.body", "body": b"data: {}\n\n", "more_body": False})
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+        task = asyncio.create_task(CompressionMiddleware(app, minimum_size=0)(scope, None, send))
+        await asyncio.sleep(0.01)
+        
+        assert [m["type"] for m in sent] == ["http.response.start"]
+        first_event.set()
+        await task
+        assert sent[-1]["body"] == b"data: {}\n\n"
+
+def make_pdf(page_texts):
+    """Build a minimal PDF with one line of Helvetica text per page"""
+    count = len(page_texts)
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(count))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {count} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return out
+
+class TestPDFTextExtraction:
+    """Test cases for PDF text extraction and its page cache"""
+    
+    @pytest.fixture
+    def server(self):
+        """Create a server instance for testing"""
+        return MCPServer()
+    
+    async def upload(self, server, page_texts):
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "upload_pdf", "arguments": {
+                "filename": "doc.pdf",
+                "content": base64.b64encode(make_pdf(page_texts)).decode()
+            }},
+            id="upload"
+        )
+        response = await server.handle_request(request)
+        assert "uploaded successfully" in response.result["content"][0]["text"]
+    
+    @pytest.mark.asyncio
+    async def test_cache_eviction_during_extraction(self):
+        """Pages cached before an extraction survive its document being evicted meanwhile"""
+        extractor = PDFTextExtractor(max_cached_pages=3)
+        content = make_pdf(["a1", "a2", "a3"])
+
+        for extract in (lambda: extractor.extract(content, "1-3"),
+                        lambda: extractor.extract_in_background(content)):
+            extractor.evict(content_hash(content))
+            await extractor.extract(content, "1")
+
+            task = asyncio.create_task(extract())
+            await asyncio.sleep(0)
+            # Another document fills the cache while the extraction runs
+            extractor._store("other", 3, {1: "b1", 2: "b2", 3: "b3"})
+            page_count, texts = await task
+
+            assert page_count == 3
+            assert [texts[page].strip() for page in (1, 2, 3)] == ["a1", "a2", "a3"]
+
+    def test_parse_page_ranges(self):
+        """Page range specs are 1-based, ordered and de-duplicated"""
+        assert parse_page_ranges(None, 3) == [1, 2, 3]
+        assert parse_page_ranges("2-3,1,2", 5) == [2, 3, 1]
+        assert parse_page_ranges("4-", 5) == [4, 5]
+        with pytest.raises(ValueError):
+            parse_page_ranges("6", 5)
+        with pytest.raises(ValueError):
+            parse_page_ranges("a-b", 5)
+    
+    @pytest.mark.asyncio
+    async def test_extract_selected_pages(self, server):
+        """pdf_extract_text returns only the requested pages"""
+        await self.upload(server, ["Alpha page", "Beta page", "Gamma page"])
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "pdf_extract_text", "arguments": {"file_id": "uploaded_1", "pages": "2-3"}},
+            id="extract-1"
+        )
+        response = await server.handle_request(request)
+        text = response.result["content"][0]["text"]
+        
+        assert "Alpha" not in text
+        assert "--- Page 2 of 3 ---\nBeta page" in text
+        assert "Gamma page" in text
+    
+    @pytest.mark.asyncio
+    async def test_upload_pre_extracts_into_cache(self, server):
+        """Uploads are extracted in the background and later reads hit the cache"""
+        await self.upload(server, ["One", "Two"])
+        await server.pdf_text.wait_idle()
+        
+        digest = server.uploaded_files["uploaded_1"]["sha256"]
+        assert server.pdf_text.documents[digest].pages == {1: "One", 2: "Two"}
+        
+        # Served from cache without touching the (now unreadable) content
+        server.uploaded_files["uploaded_1"]["content"] = b"%PDF-corrupt"
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "pdf_extract_text", "arguments": {"file_id": "uploaded_1", "pages": "2"}},
+            id="extract-2"
+        )
+        response = await server.handle_request(request)
+        assert "Two" in response.result["content"][0]["text"]
+    
+    @pytest.mark.asyncio
+    async def test_cache_evicts_least_recently_used(self):
+        """The page cache stays within its bound by evicting old documents"""
+        extractor = PDFTextExtractor(max_cached_pages=3)
+        first = make_pdf(["a", "b"])
+        second = make_pdf(["c", "d"])
+        
+        await extractor.extract(first)
+        await extractor.extract(second)
+        
+        assert extractor.cached_pages == 2
+        assert len(extractor.documents) == 1
+    
+    @pytest.mark.asyncio
+    async def test_invalid_page_range(self, server):
+        """Out of range pages are reported as a tool error"""
+        await self.upload(server, ["Only page"])
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "pdf_extract_text", "arguments": {"file_id": "uploaded_1", "pages": "5"}},
+            id="extract-3"
+        )
+        response = await server.handle_request(request)
+        assert response.result["content"][0]["text"].startswith("Error:")
+
+class TestDocumentSearch:
+    """Test cases for the full-text search index"""
+    
+    @pytest.fixture
+    def index(self):
+        """Create a small index for testing"""
+        index = SearchIndex()
+        index.add_document("uploaded_1", "fruit.pdf", {1: "apple banana apple", 2: "cherry"})
+        index.add_document("uploaded_2", "trees.pdf", {1: "oak apple tree", 2: "pine forest"})
+        index.add_document("uploaded_3", "rocks.pdf", {1: "granite basalt"})
+        return index
+    
+    def test_bm25_ranking(self, index):
+        """Documents are ranked by their best page and report matching pages"""
+        results = index.search("apple")
+        
+        assert [r["file_id"] for r in results] == ["uploaded_1", "uploaded_2"]
+        assert results[0]["pages"][0]["page"] == 1
+        assert results[0]["score"] > results[1]["score"]
+        assert index.search("pine")[0]["filename"] == "trees.pdf"
+        assert index.search("missing") == []
+    
+    def test_remove_document(self, index):
+        """Removed documents drop out of results and statistics"""
+        assert index.remove_document("uploaded_1")
+        
+        assert [r["file_id"] for r in index.search("apple")] == ["uploaded_2"]
+        assert len(index) == 3
+        index.compact()
+        assert [r["file_id"] for r in index.search("apple")] == ["uploaded_2"]
+    
+    def test_near_stopwords_are_not_scanned(self):
+        """Terms on more than max_scanned_postings pages only rescore or score the newest pages"""
+        index = SearchIndex()
+        index.max_scanned_postings = 3
+        for number in range(1, 7):
+            index.add_document(f"uploaded_{number}", f"{number}.pdf", {1: "the report"})
+        index.add_document("uploaded_7", "7.pdf", {1: "the zebra report"})
+
+        assert [r["file_id"] for r in index.search("the zebra", limit=1)] == ["uploaded_7"]
+        assert {r["file_id"] for r in index.search("the")} == {"uploaded_5", "uploaded_6", "uploaded_7"}
+
+    def test_removed_pages_do_not_lower_idf(self, tmp_path):
+        """Tombstoned pages leave the document frequency, in memory and mapped"""
+        index = SearchIndex()
+        for number in range(1, 12):
+            index.add_document(f"uploaded_{number}", f"{number}.pdf", {1: f"apple note{number}"})
+        for number in range(1, 11):
+            index.remove_document(f"uploaded_{number}")
+        
+        assert [r["file_id"] for r in index.search("apple")] == ["uploaded_11"]
+        
+        path = str(tmp_path / "index.bin")
+        index.add_document("uploaded_12", "12.pdf", {1: "apple"})
+        index.save(path)
+        loaded = SearchIndex.load(path)
+        loaded.remove_document("uploaded_11")
+        
+        assert [r["file_id"] for r in loaded.search("apple")] == ["uploaded_12"]
+        assert loaded.search("apple")[0]["score"] > 0
+    
+    def test_save_and_load(self, index, tmp_path):
+        """A saved index is mapped back with identical results and stays updatable"""
+        path = str(tmp_path / "index.bin")
+        index.remove_document("uploaded_3")
+        index.save(path)
+        loaded = SearchIndex.load(path)
+        
+        assert len(loaded) == len(index)
+        assert loaded.search("apple tree") == index.search("apple tree")
+        
+        loaded.add_document("uploaded_4", "orchard.pdf", {1: "apple apple apple orchard"})
+        assert loaded.search("apple")[0]["file_id"] == "uploaded_4"
+        assert loaded.search("granite") == []
+
+    def test_save_compacts_mapped_index_in_place(self, index, tmp_path):
+        """Saving a mapped index drops removed pages without copying postings to the heap"""
+        path = str(tmp_path / "index.bin")
+        index.save(path)
+        loaded = SearchIndex.load(path)
+        loaded.remove_document("uploaded_1")
+
+        loaded.save(path)
+
+        assert loaded.postings == {}
+        assert len(loaded.pages) == len(loaded) == 3
+        assert {r["file_id"] for r in loaded.search("apple granite")} == {"uploaded_2", "uploaded_3"}
+        assert SearchIndex.load(path).search("apple granite") == loaded.search("apple granite")
+        assert [p.name for p in tmp_path.iterdir()] == ["index.bin"]
+
+    @staticmethod
+    async def upload(server, text):
+        """Upload a one-page PDF and wait until it is indexed"""
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": "upload_pdf", "arguments": {
+                "filename": f"{text}.pdf",
+                "content": base64.b64encode(make_pdf([text])).decode()
+            }},
+            id="upload"
+        )
+        response = await server.handle_request(request)
+        await server.search.wait_idle()
+        return response.result["content"][0]["text"]
+    
+    @staticmethod
+    async def call(server, name, **arguments):
+        request = MCPRequest(
+            method="tools/call",
+            params={"name": name, "arguments": arguments},
+            id="call"
+        )
+        response = await server.handle_request(request)
+        return response.result["content"][0]["text"]
+    
+    @pytest.mark.asyncio
+    async def test_uploads_are_indexed_and_evicted(self):
+        """upload_pdf feeds the index and evicted uploads leave it"""
+        server = MCPServer()
+        server.max_uploads = 1
+        
+        await self.upload(server, "Zebra")
+        assert "Zebra.pdf (uploaded_1)" in await self.call(server, "search_documents", query="zebra")
+        
+        await self.upload(server, "Walrus")
+        assert list(server.uploaded_files) == ["uploaded_2"]
+        assert (await self.call(server, "search_documents", query="zebra")).startswith("No documents match")
+        assert "Walrus.pdf (uploaded_2)" in await self.call(server, "search_documents", query="walrus")
+    
+    @pytest.mark.asyncio
+    async def test_evicted_uploads_keep_live_matches(self):
+        """Evicting many matching uploads still finds the one that is left"""
+        server = MCPServer()
+        server.max_uploads = 1
+        for _ in range(11):
+            await self.upload(server, "Apple")
+        
+        assert "Apple.pdf (uploaded_11)" in await self.call(server, "search_documents", query="apple")
+    
+    @pytest.mark.asyncio
+    async def test_indexing_uses_background_pool(self):
+        """Index extraction never falls back to the interactive pool"""
+        pdf_text = PDFTextExtractor(max_pending=0)
+        pdf_text._pool.shutdown()
+        server = MCPServer(pdf_text=pdf_text)
+
+        await self.upload(server, "Zebra")
+
+        assert "Zebra.pdf (uploaded_1)" in await self.call(server, "search_documents", query="zebra")
+
+    @pytest.mark.asyncio
+    async def test_indexing_queue_is_bounded(self):
+        """Uploads beyond the indexing queue are stored but not indexed"""
+        server = MCPServer(search=DocumentSearch(max_pending=1))
+
+        async def upload(text):
+            content = base64.b64encode(make_pdf([text])).decode()
+            return await self.call(server, "upload_pdf", filename=f"{text}.pdf", content=content)
+
+        assert "busy" not in await upload("Zebra")
+        assert "indexing is busy" in await upload("Walrus")
+        await server.search.wait_idle()
+
+        assert list(server.uploaded_files) == ["uploaded_1", "uploaded_2"]
+        assert "Zebra.pdf" in await self.call(server, "search_documents", query="zebra")
+        assert (await self.call(server, "search_documents", query="walrus")).startswith("No documents match")
+
+    @pytest.mark.asyncio
+    async def test_uploads_survive_restart(self, tmp_path):
+        """A restarted server restores its uploads and keeps them bounded"""
+        path = str(tmp_path / "index.bin")
+        server = MCPServer(search=DocumentSearch(path, save_delay=0))
+        server.restore_uploads()
+        await self.upload(server, "Zebra")
+        await self.upload(server, "Walrus")
+        await server.close()
+        
+        server = MCPServer(search=DocumentSearch(path, save_delay=0))
+        server.restore_uploads()
+        server.max_uploads = 2
+        
+        assert list(server.uploaded_files) == ["uploaded_1", "uploaded_2"]
+        assert "Zebra.pdf (uploaded_1)" in await self.call(server, "search_documents", query="zebra")
+        assert "Zebra" in await self.call(server, "pdf_extract_text", file_id="uploaded_1")
+        
+        assert "ID: uploaded_3" in await self.upload(server, "Okapi")
+        assert list(server.uploaded_files) == ["uploaded_2", "uploaded_3"]
+        assert (await self.call(server, "search_documents", query="zebra")).startswith("No documents match")
+        assert sorted(p.name for p in (tmp_path / "index.bin.uploads").iterdir()) == [
+            "uploaded_2.pdf", "uploaded_3.pdf"
+        ]
+        await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_index_entries_without_upload_are_dropped(self, tmp_path):
+        """Search never lists a document whose upload was not persisted"""
+        path = str(tmp_path / "index.bin")
+        index = SearchIndex()
+        index.add_document("uploaded_1", "z.pdf", {1: "zebra"})
+        index.save(path)
+        
+        server = MCPServer(search=DocumentSearch(path))
+        server.restore_uploads()
+        
+        assert server.uploaded_files == {}
+        assert (await self.call(server, "search_documents", query="zebra")).startswith("No documents match")
+        await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_uploads_failing_to_load_are_kept(self, tmp_path, monkeypatch):
+        """An upload that cannot be read at start stays on disk for the next start"""
+        path = str(tmp_path / "index.bin")
+        server = MCPServer(search=DocumentSearch(path, save_delay=0))
+        server.restore_uploads()
+        await self.upload(server, "Zebra")
+        await self.upload(server, "Walrus")
+        await server.close()
+
+        read_file = search_index._read_file
+
+        def failing_read(file_path):
+            if file_path.endswith("uploaded_1.pdf"):
+                raise OSError(24, "Too many open files")
+            return read_file(file_path)
+
+        monkeypatch.setattr(search_index, "_read_file", failing_read)
+        server = MCPServer(search=DocumentSearch(path, save_delay=0))
+        server.restore_uploads()
+
+        assert list(server.uploaded_files) == ["uploaded_2"]
+        assert (tmp_path / "index.bin.uploads" / "uploaded_1.pdf").exists()
+        assert (await self.call(server, "search_documents", query="zebra")).startswith("No documents match")
+        assert "ID: uploaded_3" in await self.upload(server, "Okapi")
+        await server.close()
+
+        monkeypatch.setattr(search_index, "_read_file", read_file)
+        server = MCPServer(search=DocumentSearch(path, save_delay=0))
+        server.restore_uploads()
+        await server.search.wait_idle()
+
+        assert list(server.uploaded_files) == ["uploaded_1", "uploaded_2", "uploaded_3"]
+        assert "Zebra.pdf (uploaded_1)" in await self.call(server, "search_documents", query="zebra")
+        await server.close()
+
+    def test_single_writer_per_path(self, tmp_path):
+        """A second process opening the same path keeps its uploads in memory"""
+        path = str(tmp_path / "index.bin")
+        owner, other = DocumentSearch(path), DocumentSearch(path)
+        owner.open()
+        other.open()
+        
+        assert owner.path == path
+        assert other.path is None
+
+class TestLazyLoading:
+    """Test cases for lean server start"""
+    
+    @pytest.mark.asyncio
+    async def test_tools_list_served_from_manifest(self):
+        """tools/list returns the prebuilt manifest schemas"""
+        server = MCPServer()
+        response = await server.handle_request(MCPRequest(method="tools/list", params={}, id="m-1"))
+        
+        assert response.result["tools"] == list(TOOL_MANIFEST.values())
+        assert {"pdf_extract_text", "search_documents"} <= set(TOOL_MANIFEST)
+    
+    @pytest.mark.asyncio
+    async def test_every_manifest_tool_has_a_handler(self):
+        """Each tool in tools.json is implemented by the server"""
+        server = MCPServer()
+        for name in TOOL_MANIFEST:
+            arguments = {"steps": 1, "interval": 0} if name == "long_running_task" else {}
+            response = await server.handle_request(
+                MCPRequest(method="tools/call", params={"name": name, "arguments": arguments}, id=name)
+            )
+            
+            assert response.error is None, name
+            assert response.result["content"][0]["text"] != f"Tool {name} not implemented"
+    
+    def test_pypdf_imported_on_first_extraction(self):
+        """Building the server and listing tools does not import pypdf"""
+        script = (
+            "import asyncio, sys\n"
+            "from main import MCPServer, MCPRequest\n"
+            "server = MCPServer()\n"
+            "asyncio.run(server.handle_request(MCPRequest(method='tools/list', params={})))\n"
+            "print('pypdf' in sys.modules)\n"
+            "from pdf_text import extract_pages\n"
+            "try:\n"
+            "    extract_pages(b'%PDF-1.4')\n"
+            "except Exception:\n"
+            "    pass\n"
+            "print('pypdf' in sys.modules)\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        
+        # Logging also goes to stdout
+        assert [line for line in output if line in ("False", "True")] == ["False", "True"]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])